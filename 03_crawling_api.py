@@ -4,11 +4,17 @@ This is more stable and handles anti-bot mechanisms automatically
 """
 
 from bilibili_api import video, sync, Credential
+import asyncio
 import pandas as pd
 import time
 import random
 import os
 import sys
+from video_meta import get_cache, pages_from_view
+from crawl_state import CrawlStateStore
+from danmaku_store import DATASET_NAME, DanmakuParquetWriter, compact
+from danmaku_schema import HIDDEN_MODES, danmaku_frame, hex_color
+from rate_limiter import AdaptiveRateController
 
 # Fix Windows console encoding
 if sys.platform == 'win32':
@@ -21,13 +27,21 @@ if sys.platform == 'win32':
 INPUT_FILE = "video_index.csv"
 OUTPUT_DIR = "danmaku_results"
 SAVE_INDIVIDUAL = True
-SAVE_MERGED = True
+SAVE_MERGED = True              # Compact crawled videos into the canonical deduplicated dataset
+OUTPUT_SOURCE = "api"           # Source name of this crawler's output (see danmaku_store.py)
 CONTINUE_FROM_LAST = True
 
-# Delay settings (can be shorter with official API)
+# Delay settings (can be shorter with official API; serial mode only)
 DELAY_MIN = 2
 DELAY_MAX = 4
 
+# Async batch mode: one event loop for the whole run
+CRAWL_MODE = "async"                    # "async" = batch mode, "serial" = one video at a time
+MAX_CONCURRENT_VIDEOS = 8               # Videos being crawled at the same time
+MAX_CONCURRENT_REQUESTS = 4             # get_info / get_danmakus calls in flight
+REQUESTS_PER_SECOND = 1.0               # Initial adaptive request budget
+RATE_STATUS_FILE = "crawl_rate_03.json" # Current adaptive rate is published here
+
 # Your Bilibili credentials (extract from browser cookies)
 SESSDATA = "5ab1212e%2C1765470578%2C43aa7%2A62CjAwWHNe_t3Z9qR96rU-564ypfCZo46j6xVs5irihn-bxUec8b_DrMMQjISs7YNXgYYSVm1qdER3Y0x1OVJaZENSTnRNeS1pdVVSekZJbERBSEVVbFk1TEdhWnRzZENOYmFpYkdMZmY2Y00xbXplTFBYalFmRjBrWUlGaEU5VHEyX0Y4ektUU01nIIEC"
 BILI_JCT = "4782a1bd8c4998f79c2b024eefcb39b5"
@@ -36,6 +50,13 @@ BUVID3 = "BD945E14-BBF5-DD46-EED6-07C99C038B4F60669infoc"
 # Set credentials
 credential = Credential(sessdata=SESSDATA, bili_jct=BILI_JCT, buvid3=BUVID3)
 
+# Adaptive (AIMD) rate shared by all in-flight API calls
+rate_controller = AdaptiveRateController(
+    initial_rate=REQUESTS_PER_SECOND,
+    status_file=RATE_STATUS_FILE,
+    name="03_crawling_api"
+)
+
 # Danmaku mode mapping
 DANMAKU_MODES = {
     1: 'Scroll',
@@ -47,67 +68,139 @@ DANMAKU_MODES = {
     9: 'BAS/Hidden'
 }
 
-def crawl_video_danmaku_api(bvid, video_title, video_idx, total_videos):
-    """Crawl danmaku using bilibili-api library"""
+def danmaku_rows(danmaku_list, bvid, video_title, page):
+    """Convert bilibili-api Danmaku objects of one page into rows (tagged like 02's multi-P rows)"""
+    danmaku_data = []
+    for dm in danmaku_list:
+        # All attributes are now confirmed from test
+        mode = dm.mode
+        danmaku_data.append({
+            'bvid': bvid,
+            'video_title': video_title,
+            'video_time_sec': dm.dm_time,
+            'mode': str(mode),
+            'mode_name': DANMAKU_MODES.get(mode, f'Unknown({mode})'),
+            'font_size': dm.font_size,
+            'color': hex_color(dm.color),  # bilibili-api gives hex strings, not 02's decimal
+            'timestamp': dm.send_time,
+            'pool': dm.pool,
+            'user_hash': dm.crc32_id,
+            'dmid': dm.id_,
+            'text': dm.text,
+            'page': page['page'],
+            'cid': page['cid'],
+            'page_offset_sec': page['offset_sec']
+        })
+    return danmaku_data
+
+def print_video_stats(danmaku_df):
+    """Print mode distribution and hidden danmaku count for one video"""
+    mode_counts = danmaku_df['mode_name'].value_counts()
+    mode_str = ", ".join([f"{mode}: {count}" for mode, count in mode_counts.head(3).items()])
+    print(f"  [STATS] {mode_str}")
+    
+    hidden_count = int(danmaku_df['mode'].isin(HIDDEN_MODES).sum())
+    if hidden_count > 0:
+        print(f"  [HIDDEN] ★ {hidden_count} advanced/hidden danmaku!")
+
+async def api_call(coroutine, semaphore):
+    """Await one bilibili-api request under the request semaphore and the adaptive rate limit"""
+    async with semaphore:
+        await rate_controller.acquire_async()
+        try:
+            result = await coroutine
+        except Exception as e:
+            # NetworkException carries the HTTP status (412 = anti-crawler)
+            status = getattr(e, 'status', None)
+            if isinstance(status, int):
+                rate_controller.record(status)
+            raise
+        rate_controller.record(200)
+        return result
+
+async def crawl_video_danmaku_api_async(bvid, video_title, video_idx, total_videos, semaphore):
+    """
+    Crawl every page of one video on the running event loop: page list from the shared
+    metadata cache (get_info() only on a miss), then get_danmakus for all pages at once.
+    Returns a typed danmaku frame.
+    """
     print(f"\n[{video_idx}/{total_videos}] {bvid} | {video_title[:50]}...")
     
     try:
         # Create video object
         v = video.Video(bvid=bvid, credential=credential)
         
-        # Get video info to find cid
-        info = sync(v.get_info())
-        cid = info['cid']
+        # Find cids in the shared metadata cache; only call get_info() on a miss
+        cache = get_cache()
+        pages = cache.get_pages(bvid)
+        if not pages:
+            info = await api_call(v.get_info(), semaphore)
+            cache.put(bvid, info)
+            pages = pages_from_view({'data': info})
         
-        print(f"  [INFO] CID: {cid}")
+        print(f"  [INFO] {bvid}: {len(pages)} page(s), CID {', '.join(page['cid'] for page in pages)}")
         
-        # Get danmaku using correct method (pass page_index=0 for first page)
-        danmaku_list = sync(v.get_danmakus(page_index=0))
+        page_danmaku = await asyncio.gather(*[
+            api_call(v.get_danmakus(cid=int(page['cid'])), semaphore) for page in pages
+        ])
         
         danmaku_data = []
+        for page, danmaku_list in zip(pages, page_danmaku):
+            danmaku_data.extend(danmaku_rows(danmaku_list, bvid, video_title, page))
         
-        for dm in danmaku_list:
-            # All attributes are now confirmed from test
-            mode = dm.mode
-            danmaku_data.append({
-                'bvid': bvid,
-                'video_title': video_title,
-                'video_time_sec': dm.dm_time,
-                'mode': str(mode),
-                'mode_name': DANMAKU_MODES.get(mode, f'Unknown({mode})'),
-                'font_size': dm.font_size,
-                'color': dm.color,
-                'timestamp': dm.send_time,
-                'pool': dm.pool,
-                'user_hash': dm.crc32_id,
-                'dmid': dm.id_,
-                'text': dm.text
-            })
+        print(f"  [SUCCESS] {bvid}: Collected {len(danmaku_data)} danmaku")
+        if not danmaku_data:
+            return None, "empty"
         
-        print(f"  [SUCCESS] Collected {len(danmaku_data)} danmaku")
-        
-        # Show statistics
-        if danmaku_data:
-            df_temp = pd.DataFrame(danmaku_data)
-            mode_counts = df_temp['mode_name'].value_counts()
-            mode_str = ", ".join([f"{mode}: {count}" for mode, count in mode_counts.head(3).items()])
-            print(f"  [STATS] {mode_str}")
-            
-            hidden_count = len(df_temp[df_temp['mode'].isin(['8', '9'])])
-            if hidden_count > 0:
-                print(f"  [HIDDEN] ★ {hidden_count} advanced/hidden danmaku!")
-        
-        return danmaku_data, "success"
+        danmaku_df = danmaku_frame(danmaku_data)
+        print_video_stats(danmaku_df)
+        return danmaku_df, "success"
         
     except Exception as e:
-        print(f"  [ERROR] {str(e)}")
+        print(f"  [ERROR] {bvid}: {str(e)}")
         return None, "failed"
 
+def crawl_video_danmaku_api(bvid, video_title, video_idx, total_videos):
+    """Serial mode: one video per sync() call"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return sync(crawl_video_danmaku_api_async(bvid, video_title, video_idx, total_videos, semaphore))
+
+async def crawl_all_async(pending_df, on_result):
+    """
+    Batch mode: all pending videos on one event loop. At most MAX_CONCURRENT_VIDEOS
+    videos and MAX_CONCURRENT_REQUESTS API calls are in flight; each finished video
+    is handed to on_result (and written to disk) right away.
+    """
+    video_semaphore = asyncio.Semaphore(MAX_CONCURRENT_VIDEOS)
+    request_semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    total = len(pending_df)
+    
+    async def worker(video_idx, bvid, title):
+        # One video's error (crawl or on_result) is recorded as a failure instead of ending the batch
+        try:
+            async with video_semaphore:
+                danmaku_df, status = await crawl_video_danmaku_api_async(
+                    bvid, title, video_idx, total, request_semaphore
+                )
+                on_result(bvid, title, danmaku_df, status)
+        except Exception as e:
+            print(f"  [ERROR] {bvid}: {e}")
+            on_result(bvid, title, None, "exception")
+    
+    await asyncio.gather(*[
+        worker(video_idx, row['bvid'], row['title'])
+        for video_idx, (_, row) in enumerate(pending_df.iterrows(), start=1)
+    ])
+
 def main():
     print("="*70)
     print("BILIBILI DANMAKU CRAWLER (Using bilibili-api library)")
     print("="*70)
-    print(f"[CONFIG] Delay: {DELAY_MIN}-{DELAY_MAX}s per video")
+    if CRAWL_MODE == "async":
+        print(f"[CONFIG] Async batch: {MAX_CONCURRENT_VIDEOS} videos / {MAX_CONCURRENT_REQUESTS} requests in flight, "
+              f"{REQUESTS_PER_SECOND} req/s (adaptive)")
+    else:
+        print(f"[CONFIG] Delay: {DELAY_MIN}-{DELAY_MAX}s per video")
     print("="*70)
     
     # Check input file
@@ -121,16 +214,20 @@ def main():
     video_df = pd.read_csv(INPUT_FILE, encoding='utf-8-sig')
     print(f"[INFO] Total videos: {len(video_df)}")
     
+    # Per-video status lives in the crawl-state store; video_index.csv is exported at the end
+    state = CrawlStateStore()
+    state.import_index(video_df, 'danmaku')
+    
     # Filter pending videos
-    if CONTINUE_FROM_LAST and 'crawled' in video_df.columns:
-        pending_df = video_df[video_df['crawled'] != 1].copy()
+    if CONTINUE_FROM_LAST:
+        pending_bvids = set(state.pending(video_df['bvid'].astype(str), 'danmaku'))
+        pending_df = video_df[video_df['bvid'].astype(str).isin(pending_bvids)].copy()
         print(f"[INFO] Pending: {len(pending_df)} videos")
         if len(pending_df) == 0:
             print("[INFO] All videos already crawled!")
             return
     else:
         pending_df = video_df.copy()
-        pending_df['crawled'] = 0
     
     # Create output directory
     if not os.path.exists(OUTPUT_DIR):
@@ -141,66 +238,76 @@ def main():
     print(f"[STEP 2] Starting crawl...")
     print(f"{'='*70}")
     
-    all_danmaku = []
-    success_count = 0
-    failed_count = 0
-    processed = 0
+    # Each video is appended to the Parquet dataset as soon as it finishes
+    sink = DanmakuParquetWriter(OUTPUT_DIR, OUTPUT_SOURCE)
+    crawled_bvids = []
+    counts = {'success': 0, 'failed': 0}
     
-    for idx, row in pending_df.iterrows():
-        bvid = row['bvid']
-        title = row['title']
-        processed += 1
-        
-        # Crawl danmaku
-        danmaku_data, status = crawl_video_danmaku_api(
-            bvid=bvid,
-            video_title=title,
-            video_idx=processed,
-            total_videos=len(pending_df)
-        )
-        
-        # Update status
-        if status == "success" and danmaku_data:
-            video_df.loc[video_df['bvid'] == bvid, 'crawled'] = 1
-            success_count += 1
-            all_danmaku.extend(danmaku_data)
+    def on_result(bvid, title, danmaku_df, status):
+        """Record one video's outcome: crawl state, individual CSV, Parquet dataset"""
+        if status == "success" and danmaku_df is not None:
+            # danmaku_df is a compact typed frame (titles stay in video_index.csv)
+            sink.write_video(bvid, danmaku_df)
+            crawled_bvids.append(bvid)
             
             # Save individual file
             if SAVE_INDIVIDUAL:
-                df_ind = pd.DataFrame(danmaku_data)
                 safe_title = "".join(c for c in title[:40] if c.isalnum() or c in (' ', '-', '_')).strip()
-                filename = f"{OUTPUT_DIR}/{bvid}_{safe_title}.csv"
-                df_ind.to_csv(filename, encoding='utf-8-sig', index=False)
+                filename = f"{sink.csv_dir}/{bvid}_{safe_title}.csv"
+                danmaku_df.to_csv(filename, encoding='utf-8-sig', index=False)
                 print(f"  [SAVED] {os.path.basename(filename)}")
+            
+            # Marked done only once its files are written
+            state.set_status(bvid, 'danmaku', 1, method='api', count=len(danmaku_df))
+            counts['success'] += 1
         else:
-            video_df.loc[video_df['bvid'] == bvid, 'crawled'] = -1
-            failed_count += 1
-        
-        # Update index
-        video_df.to_csv(INPUT_FILE, encoding='utf-8-sig', index=False)
-        
-        # Rate limiting
-        delay = random.uniform(DELAY_MIN, DELAY_MAX)
-        print(f"  [WAIT] {delay:.1f}s...")
-        time.sleep(delay)
+            state.set_status(bvid, 'danmaku', -1, error=status)
+            counts['failed'] += 1
+    
+    try:
+        if CRAWL_MODE == "async":
+            sync(crawl_all_async(pending_df, on_result))
+        else:
+            processed = 0
+            for idx, row in pending_df.iterrows():
+                bvid = row['bvid']
+                title = row['title']
+                processed += 1
+                
+                # Crawl danmaku
+                try:
+                    danmaku_df, status = crawl_video_danmaku_api(
+                        bvid=bvid,
+                        video_title=title,
+                        video_idx=processed,
+                        total_videos=len(pending_df)
+                    )
+                    on_result(bvid, title, danmaku_df, status)
+                except Exception as e:
+                    print(f"  [ERROR] {bvid}: {e}")
+                    on_result(bvid, title, None, "exception")
+                
+                # Rate limiting
+                delay = random.uniform(DELAY_MIN, DELAY_MAX)
+                print(f"  [WAIT] {delay:.1f}s...")
+                time.sleep(delay)
+    finally:
+        # Regenerate index from crawl state, even if the crawl was interrupted
+        state.export_index(INPUT_FILE)
+        print(f"\n[SAVED] {INPUT_FILE} (exported from crawl state)")
     
-    # Save merged file
-    if SAVE_MERGED and all_danmaku:
+    success_count = counts['success']
+    failed_count = counts['failed']
+    
+    # Merge this run's videos with the other sources into the canonical dataset (dedup on dmid)
+    print(f"\n[SAVED] {sink.path}/ (source '{OUTPUT_SOURCE}', {sink.total:,} danmaku this run)")
+    if SAVE_MERGED and crawled_bvids:
         print(f"\n{'='*70}")
-        print(f"[STEP 3] Saving merged results...")
+        print(f"[STEP 3] Compacting merged results...")
         print(f"{'='*70}")
-        
-        df_all = pd.DataFrame(all_danmaku)
-        merged_file = f"{OUTPUT_DIR}/all_danmaku_merged.csv"
-        df_all.to_csv(merged_file, encoding='utf-8-sig', index=False)
-        print(f"[SAVED] {merged_file}")
-        
-        # Save hidden danmaku only
-        df_hidden = df_all[df_all['mode'].isin(['8', '9'])]
-        if not df_hidden.empty:
-            hidden_file = f"{OUTPUT_DIR}/hidden_danmaku_only.csv"
-            df_hidden.to_csv(hidden_file, encoding='utf-8-sig', index=False)
-            print(f"[SAVED] {hidden_file} ({len(df_hidden)} hidden)")
+        compact(OUTPUT_DIR, crawled_bvids)
+        print(f"[INFO] Hidden view: danmaku_store.hidden_view('{OUTPUT_DIR}/{DATASET_NAME}')")
+        print(f"[INFO] Legacy CSVs: python danmaku_store.py --csv {OUTPUT_DIR}/{DATASET_NAME}")
     
     # Final statistics
     print(f"\n{'='*70}")
@@ -209,19 +316,17 @@ def main():
     print(f"Processed: {success_count + failed_count} videos")
     print(f"  ✓ Success: {success_count}")
     print(f"  ✗ Failed: {failed_count}")
-    print(f"Total danmaku: {len(all_danmaku):,}")
+    print(f"Total danmaku: {sink.total:,}")
     
-    if all_danmaku:
-        df_all = pd.DataFrame(all_danmaku)
+    if sink.total:
+        # Running counts kept by the sink; no need to reload the merged data
         print(f"\nMode distribution:")
-        mode_counts = df_all['mode_name'].value_counts()
-        for mode, count in mode_counts.items():
-            pct = count / len(all_danmaku) * 100
+        for mode, count in sink.mode_counts.most_common():
+            pct = count / sink.total * 100
             print(f"  {mode:20s}: {count:>8,} ({pct:>5.1f}%)")
         
-        hidden_count = len(df_all[df_all['mode'].isin(['8', '9'])])
-        if hidden_count > 0:
-            print(f"\n★ Hidden danmaku: {hidden_count:,} ({hidden_count/len(all_danmaku)*100:.1f}%)")
+        if sink.hidden > 0:
+            print(f"\n★ Hidden danmaku: {sink.hidden:,} ({sink.hidden/sink.total*100:.1f}%)")
     
     print(f"\n{'='*70}")
     print(f"[DONE] Results in: {OUTPUT_DIR}/")
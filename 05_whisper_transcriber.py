@@ -2,11 +2,18 @@ import os
 import sys
 import time
 import glob
+import queue
 import logging
+import threading
+import tempfile
 import subprocess
-from typing import Optional
+from typing import Optional, Union
 import pandas as pd
 
+import asr_backends
+import speech_chunks
+from transcription_pool import TranscriptionPool
+
 INPUT_CSV = "outputs/01_video_index/videos_without_subtitle.csv"
 
 BASE_DIR = os.path.abspath(".")
@@ -17,16 +24,43 @@ JSON_DIR = os.path.join(OUT_DIR, "03_subtitles_json")
 LOG_DIR = os.path.join(OUT_DIR, "logs")
 
 MODEL_SIZE = "medium"     # tiny | base | small | medium | large
+# 识别引擎（见 asr_backends.py）："whisper" = openai-whisper（PyTorch）
+#           "faster-whisper" = CTranslate2 int8，CPU 上快数倍；"auto" = 有 CUDA 用 whisper，否则 faster-whisper
+ASR_BACKEND = "auto"
+COMPUTE_TYPE = "int8"     # faster-whisper 计算精度：int8 | int8_float16 | float16 | float32
+CPU_THREADS = 0           # faster-whisper CPU 线程数，0 = 自动（单进程时）
 MAX_RETRIES = 3           # download/transcribe retries
 SLEEP_BETWEEN = (3, 7)    # 各任务间随机休眠秒数区间
 DELETE_AUDIO_AFTER = True # 转录成功后删除音频以省空间
 
-# yt-dlp 模板
-YTDLP_TPL = os.path.join(AUDIO_DIR, "%(id)s.%(ext)s")
+# 流水线：下载线程预取后续视频的音频，主线程同时转录
+PIPELINED = True          # False = 逐个视频：下载 → 转录 → 休眠
+DOWNLOAD_WORKERS = 2      # 并行下载音频的线程数
+PREFETCH_VIDEOS = 3       # 已下载、等待转录的音频数上限（K）
+
+# 多进程转录（见 transcription_pool.py）：N 个模型进程，按音频时长最长优先调度
+# 每个进程各载一份模型（medium：fp32 约 2 GB，int8 约 0.8 GB），N × 线程数 ≈ 物理核数
+TRANSCRIBE_WORKERS = 1    # 1 = 主进程内转录（原流程）
+THREADS_PER_WORKER = 4    # 每个进程的 torch / CTranslate2 计算线程数
+PIN_WORKER_CORES = True   # 各进程绑定到互不重叠的 CPU 核（仅 Linux）
+
+# VAD 切块（见 speech_chunks.py）：跳过静音/音乐，在静音处切块；多进程时各块并行转录，时间戳拼回整段
+VAD_CHUNKING = True
+MAX_CHUNK_SECONDS = 60    # 块长上限（秒）；越短并行度越高，但块边界处上下文越少
+MIN_SILENCE_MS = 500      # 至少这么长的静音才作为切分点
+
+# 音频输入："pcm" = 体积最小的纯音频流经一次 ffmpeg 重采样，直接读入内存（不落盘、不转 mp3）
+#           "pcm_mmap" = 同上，但写入原始 PCM 文件后内存映射（预取多个长视频时省内存；多进程时只传文件名）
+#           "mp3" = yt-dlp 转码为 mp3，Whisper 再解码（旧流程）
+AUDIO_INGEST = "pcm"
+AUDIO_FORMAT = "wa"       # yt-dlp 格式选择：wa = 体积最小的纯音频流
+SAMPLE_RATE = 16000       # Whisper 输入：16 kHz 单声道 float32
+
+# yt-dlp 模板（按 bvid 命名，并行下载时互不混淆）
+YTDLP_TPL = os.path.join(AUDIO_DIR, "{bvid}.%(ext)s")
 YTDLP_CMD = [
     "yt-dlp",
     "-x", "--audio-format", "mp3",
-    "-o", YTDLP_TPL,
 ]
 
 # ==================== 日志设置 ====================
@@ -65,16 +99,14 @@ def _ensure_dependencies():
     if not _check_command_exists("ffmpeg"):
         logging.error("未检测到 ffmpeg，请先安装（Mac: brew install ffmpeg | Ubuntu: apt-get install ffmpeg | Win: choco install ffmpeg）")
         sys.exit(1)
-    # whisper / torch
+    # 识别引擎（whisper / faster-whisper）
     try:
-        import whisper  # noqa
-    except Exception:
-        logging.error("未检测到 openai-whisper，请先安装：pip install openai-whisper")
+        hint = asr_backends.missing_dependency(ASR_BACKEND)
+    except ValueError as e:
+        logging.error(str(e))
         sys.exit(1)
-    try:
-        import torch  # noqa
-    except Exception:
-        logging.error("未检测到 torch，请先安装（根据平台选择正确版本），例如：pip install torch")
+    if hint:
+        logging.error(f"未检测到 {asr_backends.resolve_backend(ASR_BACKEND)}，请先安装：{hint}")
         sys.exit(1)
 
 def _gpu_info_str() -> str:
@@ -94,60 +126,123 @@ def download_audio_by_bvid(bvid: str, url: str) -> Optional[str]:
     for attempt in range(1, MAX_RETRIES + 1):
         try:
             logging.info(f"开始下载音频（第 {attempt}/{MAX_RETRIES} 次）：{bvid}")
-            cmd = YTDLP_CMD + [url]
+            cmd = YTDLP_CMD + ["-o", YTDLP_TPL.format(bvid=bvid), url]
             proc = subprocess.run(cmd, capture_output=True, text=True)
             if proc.returncode != 0:
                 logging.warning(f"yt-dlp 失败：{proc.stderr.strip()[:500]}")
                 _rand_sleep(*SLEEP_BETWEEN)
                 continue
-            # 依据 bvid 匹配下载的文件（yt-dlp 的 %(id)s 通常是 BV 号）
+            # 输出文件名即 bvid
             pattern = os.path.join(AUDIO_DIR, f"{bvid}.*")
             candidates = glob.glob(pattern)
             if candidates:
                 # 优先选 mp3
                 mp3s = [p for p in candidates if p.lower().endswith(".mp3")]
                 return mp3s[0] if mp3s else candidates[0]
-            else:
-                # 回退：找最新的 mp3
-                newest = sorted(glob.glob(os.path.join(AUDIO_DIR, "*.mp3")), key=os.path.getmtime, reverse=True)
-                if newest:
-                    return newest[0]
         except Exception as e:
             logging.warning(f"下载异常：{e}")
         _rand_sleep(*SLEEP_BETWEEN)
     return None
 
-def transcribe_with_timestamps(audio_path: str, model):
+def ingest_pcm_by_bvid(bvid: str, url: str):
+    """
+    yt-dlp 把最小的纯音频流写到 stdout，管道接一次 ffmpeg 重采样为 16 kHz 单声道 float32。
+    AUDIO_INGEST="pcm" 返回 numpy 数组；"pcm_mmap" 写入 {bvid}.f32 并返回其路径。
+    中途出错（含 Ctrl+C）时结束并回收子进程，删除写了一半的 {bvid}.f32
+    """
+    import numpy as np
+    raw_path = os.path.join(AUDIO_DIR, f"{bvid}.f32")
+    ffmpeg_output = raw_path if AUDIO_INGEST == "pcm_mmap" else "pipe:1"
+    for attempt in range(1, MAX_RETRIES + 1):
+        procs = []
+        result = None
+        try:
+            logging.info(f"开始读取音频流（第 {attempt}/{MAX_RETRIES} 次）：{bvid}")
+            # stderr 写入临时文件，避免管道写满导致子进程阻塞
+            with tempfile.TemporaryFile() as ytdlp_err, tempfile.TemporaryFile() as ffmpeg_err:
+                ytdlp = subprocess.Popen(
+                    ["yt-dlp", "-f", AUDIO_FORMAT, "--no-progress", "-q", "-o", "-", url],
+                    stdout=subprocess.PIPE, stderr=ytdlp_err
+                )
+                procs.append(ytdlp)
+                ffmpeg = subprocess.Popen(
+                    ["ffmpeg", "-nostdin", "-loglevel", "error", "-i", "pipe:0",
+                     "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "-y", ffmpeg_output],
+                    stdin=ytdlp.stdout, stdout=subprocess.PIPE, stderr=ffmpeg_err
+                )
+                procs.append(ffmpeg)
+                ytdlp.stdout.close()  # 管道只由 ffmpeg 持有
+                pcm = bytearray()
+                while True:
+                    chunk = ffmpeg.stdout.read(1 << 20)
+                    if not chunk:
+                        break
+                    pcm += chunk
+                ffmpeg.wait()
+                ytdlp.wait()
+                if ytdlp.returncode != 0 or ffmpeg.returncode != 0:
+                    ytdlp_err.seek(0)
+                    ffmpeg_err.seek(0)
+                    message = (ytdlp_err.read() + ffmpeg_err.read()).decode("utf-8", errors="replace")
+                    logging.warning(f"音频流读取失败：{message.strip()[:500]}")
+                elif AUDIO_INGEST == "pcm_mmap":
+                    if os.path.getsize(raw_path) > 0:
+                        result = raw_path
+                elif pcm:
+                    # bytearray 可写，Whisper/torch 可直接使用，无需复制
+                    result = np.frombuffer(pcm, dtype=np.float32)
+        except Exception as e:
+            logging.warning(f"音频流异常：{e}")
+        finally:
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+                proc.wait()
+                if proc.stdout is not None:
+                    proc.stdout.close()
+            if result is None and AUDIO_INGEST == "pcm_mmap" and os.path.exists(raw_path):
+                os.remove(raw_path)
+        if result is not None:
+            return result
+        _rand_sleep(*SLEEP_BETWEEN)
+    return None
+
+def fetch_audio(bvid: str, url: str):
+    """
+    按 AUDIO_INGEST 获取音频：文件路径（mp3 / 原始 PCM）或内存中的 PCM 数组；失败返回 None
+    """
+    if AUDIO_INGEST == "mp3":
+        return download_audio_by_bvid(bvid, url)
+    return ingest_pcm_by_bvid(bvid, url)
+
+def split_speech(pcm) -> list:
     """
-    Whisper 转录，返回（纯文本、带时间戳的segments、段落数）
+    VAD 切块并记录语音占比
     """
-    import whisper
-    logging.info(f"开始转录：{os.path.basename(audio_path)}")
-    result = model.transcribe(
-        audio_path,
-        language="zh",
-        verbose=False,
-        initial_prompt="以下是一段中文视频的逐字转录。"
-    )
-    segments = result.get("segments", [])
-    
-    # 纯文本：合并所有 segment 的 text
-    lines = []
+    chunks = speech_chunks.split_speech(pcm, MAX_CHUNK_SECONDS, MIN_SILENCE_MS)
+    speech = sum(end - start for start, end in chunks)
+    logging.info(f"VAD：{len(pcm) / SAMPLE_RATE:.0f}s 音频中语音 {speech / SAMPLE_RATE:.0f}s，切为 {len(chunks)} 块")
+    return chunks
+
+def transcribe_with_timestamps(audio: Union[str, "np.ndarray"], backend: asr_backends.ASRBackend):
+    """
+    经识别后端转录，返回（纯文本、带时间戳的字幕列表、段落数）
+    audio 为音频文件路径、原始 PCM 文件（.f32，内存映射）或 16 kHz float32 数组
+    """
+    if isinstance(audio, str):
+        logging.info(f"开始转录：{os.path.basename(audio)}")
+    else:
+        logging.info(f"开始转录：{len(audio) / SAMPLE_RATE:.0f}s PCM")
     # 带时间戳的字幕列表（兼容B站字幕格式）
-    subtitles = []
-    
-    for seg in segments:
-        text = str(seg.get("text", "")).strip()
-        if text:
-            lines.append(text)
-            # 保存时间戳信息
-            subtitles.append({
-                "from": seg.get("start", 0),
-                "to": seg.get("end", 0),
-                "content": text,
-                "location": 2  # B站字幕格式：2表示底部居中
-            })
-    
+    if VAD_CHUNKING:
+        pcm = speech_chunks.load_pcm(audio)
+        chunks = split_speech(pcm)
+        subtitles = speech_chunks.stitch([(start, end, backend.transcribe(pcm[start:end])) for start, end in chunks])
+    else:
+        subtitles = backend.transcribe(audio)
+    # 纯文本：合并所有段落
+    lines = [sub["content"] for sub in subtitles]
+
     plain_text = "\n".join(lines).strip()
     return plain_text, subtitles, len(lines)
 
@@ -165,6 +260,175 @@ def save_json(bvid: str, subtitles: list) -> str:
         json.dump(subtitles, f, ensure_ascii=False, indent=2)
     return out_path
 
+def serial_audio(videos):
+    """
+    逐个下载：yield (bvid, title, 音频或 None)，每个视频处理完后随机休眠（音频见 fetch_audio）
+    """
+    for bvid, url, title in videos:
+        yield bvid, title, fetch_audio(bvid, url)
+        _rand_sleep(*SLEEP_BETWEEN)
+
+def prefetched_audio(videos):
+    """
+    生产者-消费者：DOWNLOAD_WORKERS 个线程依次下载，结果放入容量为 PREFETCH_VIDEOS 的队列；
+    调用方（转录）从队列取出 (bvid, title, 音频或 None)，顺序为下载完成的顺序。
+    队列满时下载线程阻塞，磁盘上等待转录的音频不会无限堆积。
+    下载线程在调用时立即启动（可与模型加载重叠）。
+    """
+    tasks = queue.Queue()
+    for video in videos:
+        tasks.put(video)
+    ready = queue.Queue(maxsize=PREFETCH_VIDEOS)
+
+    def download_worker():
+        while True:
+            try:
+                bvid, url, title = tasks.get_nowait()
+            except queue.Empty:
+                break
+            ready.put((bvid, title, fetch_audio(bvid, url)))
+            # 下载之间仍随机休眠；转录不再等待
+            if not tasks.empty():
+                _rand_sleep(*SLEEP_BETWEEN)
+        ready.put(None)
+
+    workers = [threading.Thread(target=download_worker, name=f"download-{i}", daemon=True)
+               for i in range(DOWNLOAD_WORKERS)]
+    for worker in workers:
+        worker.start()
+
+    def drain():
+        finished = 0
+        while finished < len(workers):
+            item = ready.get()
+            if item is None:
+                finished += 1
+            else:
+                yield item
+
+    return drain()
+
+def save_transcript(df, bvid: str, audio, subtitles: list):
+    """
+    保存 TXT/JSON、更新 CSV、删除音频
+    """
+    lines = [sub["content"] for sub in subtitles]
+
+    # 保存纯文本
+    out_txt = save_txt(bvid, "\n".join(lines).strip())
+    logging.info(f"TXT 已保存：{out_txt}（段落数：{len(lines)}）")
+
+    # 保存带时间戳的JSON
+    out_json = save_json(bvid, subtitles)
+    logging.info(f"JSON 已保存：{out_json}（带时间戳）")
+
+    # 更新 CSV
+    df.loc[df["bvid"] == bvid, "has_subtitle"] = 1
+    df.loc[df["bvid"] == bvid, "subtitle_method"] = "whisper"
+    df.loc[df["bvid"] == bvid, "subtitle_count"] = len(lines)
+    df.to_csv(INPUT_CSV, index=False, encoding="utf-8-sig")
+
+    # 删除音频文件（可选；内存中的 PCM 无需处理）
+    if DELETE_AUDIO_AFTER and isinstance(audio, str):
+        try:
+            os.remove(audio)
+            logging.info("已删除音频文件（节省空间）")
+        except Exception as e:
+            logging.warning(f"删除音频失败：{e}")
+
+def transcribe_and_save(df, bvid: str, audio, backend) -> bool:
+    """
+    转录（带重试）并保存；成功返回 True
+    """
+    subtitles = []
+    ok = False
+    for attempt in range(1, MAX_RETRIES + 1):
+        try:
+            _, subtitles, _ = transcribe_with_timestamps(audio, backend)
+            ok = True
+            break
+        except Exception as e:
+            logging.warning(f"转录失败（第 {attempt}/{MAX_RETRIES} 次）：{e}")
+            _rand_sleep(*SLEEP_BETWEEN)
+    if not ok:
+        logging.warning(f"{bvid} 转录失败，跳过。")
+        return False
+    save_transcript(df, bvid, audio, subtitles)
+    return True
+
+def audio_ok(bvid: str, audio) -> bool:
+    if audio is None or (isinstance(audio, str) and not os.path.exists(audio)):
+        logging.warning(f"{bvid} 音频下载失败，跳过。")
+        return False
+    return True
+
+def transcribe_in_pool(df, audio_stream, total: int) -> int:
+    """
+    多进程转录：下载好的音频（VAD_CHUNKING 时为各语音块）进入转录池，
+    一个视频的所有块完成后拼接并保存；返回成功数
+    """
+    backend_name = asr_backends.resolve_backend(ASR_BACKEND)
+    pool = TranscriptionPool(backend_name, MODEL_SIZE, TRANSCRIBE_WORKERS, THREADS_PER_WORKER,
+                             pin_cores=PIN_WORKER_CORES, compute_type=COMPUTE_TYPE)
+    logging.info(f"多进程转录：{TRANSCRIBE_WORKERS} 个 {backend_name} 进程 × {THREADS_PER_WORKER} 线程"
+                 f"{'（已绑定 CPU 核）' if pool.pinned else ''}，最长优先")
+
+    # bvid -> {"audio", "chunks": [(start, end)] 或 None（整段）, "results": {块序号: 字幕}, "failed"}
+    videos = {}
+
+    def jobs():
+        for bvid, _, audio in audio_stream:
+            if not audio_ok(bvid, audio):
+                continue
+            if not VAD_CHUNKING:
+                videos[bvid] = {"audio": audio, "chunks": None, "results": {}, "failed": False}
+                yield (bvid, 0), audio
+                continue
+            pcm = speech_chunks.load_pcm(audio)
+            chunks = split_speech(pcm)
+            videos[bvid] = {"audio": audio, "chunks": chunks, "results": {}, "failed": False}
+            for index, (start, end) in enumerate(chunks):
+                yield (bvid, index), pcm[start:end]
+
+    def finish(bvid):
+        video = videos.pop(bvid)
+        if video["chunks"] is None:
+            subtitles = video["results"][0]
+        else:
+            subtitles = speech_chunks.stitch([(start, end, video["results"][index])
+                                              for index, (start, end) in enumerate(video["chunks"])])
+        save_transcript(df, bvid, video["audio"], subtitles)
+
+    processed = 0
+    done = 0
+    with pool:
+        results = pool.run(jobs(), window=PREFETCH_VIDEOS + TRANSCRIBE_WORKERS, retries=MAX_RETRIES)
+        for (bvid, index), _, subtitles, error in results:
+            video = videos[bvid]
+            if error is not None:
+                logging.warning(f"{bvid} 第 {index + 1} 块转录失败：{error}")
+                video["failed"] = True
+            video["results"][index] = subtitles
+            if len(video["results"]) < len(video["chunks"] or [None]):
+                continue
+            done += 1
+            logging.info("-" * 60)
+            if video["failed"]:
+                videos.pop(bvid)
+                logging.warning(f"[{done}/{total}] {bvid} 转录失败，跳过。")
+                continue
+            logging.info(f"[{done}/{total}] 转录完成：{bvid}")
+            finish(bvid)
+            processed += 1
+
+    # 没有检测到语音的视频不产生转录任务，直接保存空字幕
+    for bvid in list(videos):
+        done += 1
+        logging.info(f"[{done}/{total}] {bvid} 未检测到语音")
+        finish(bvid)
+        processed += 1
+    return processed
+
 def main():
     logging.info("=" * 60)
     logging.info("Whisper 纯文本批量转录启动")
@@ -193,69 +457,36 @@ def main():
         logging.info("无需处理：所有视频已有字幕。")
         return
 
-    # 预加载模型一次，提升批量效率
-    import whisper
-    logging.info(f"加载 Whisper 模型：{MODEL_SIZE}（首次可能较慢）")
-    model = whisper.load_model(MODEL_SIZE)
+    videos = [
+        (str(row.get("bvid", "")).strip(),
+         str(row.get("url", f"https://www.bilibili.com/video/{row.get('bvid', '')}")).strip(),
+         str(row.get("title", "")).strip())
+        for _, row in target.iterrows()
+    ]
+    started = time.time()
+    if PIPELINED:
+        logging.info(f"流水线模式：{DOWNLOAD_WORKERS} 个下载线程，最多预取 {PREFETCH_VIDEOS} 个音频")
+        audio_stream = prefetched_audio(videos)
+    else:
+        audio_stream = serial_audio(videos)
 
-    processed = 0
-    for idx, row in target.iterrows():
-        bvid = str(row.get("bvid", "")).strip()
-        url = str(row.get("url", f"https://www.bilibili.com/video/{bvid}")).strip()
-        title = str(row.get("title", "")).strip()
-
-        logging.info("-" * 60)
-        logging.info(f"[{processed+1}/{len(target)}] 处理：{bvid} | {title[:60]}")
-
-        audio_path = download_audio_by_bvid(bvid, url)
-        if not audio_path or not os.path.exists(audio_path):
-            logging.warning(f"{bvid} 音频下载失败，跳过。")
-            continue
-
-        # 转录（带重试）
-        txt = ""
-        subtitles = []
-        seg_count = 0
-        ok = False
-        for attempt in range(1, MAX_RETRIES + 1):
-            try:
-                txt, subtitles, seg_count = transcribe_with_timestamps(audio_path, model)
-                ok = True
-                break
-            except Exception as e:
-                logging.warning(f"转录失败（第 {attempt}/{MAX_RETRIES} 次）：{e}")
-                _rand_sleep(*SLEEP_BETWEEN)
-        if not ok:
-            logging.warning(f"{bvid} 转录失败，跳过。")
-            continue
-
-        # 保存纯文本
-        out_txt = save_txt(bvid, txt)
-        logging.info(f"TXT 已保存：{out_txt}（段落数：{seg_count}）")
-        
-        # 保存带时间戳的JSON
-        out_json = save_json(bvid, subtitles)
-        logging.info(f"JSON 已保存：{out_json}（带时间戳）")
-
-        # 更新 CSV
-        df.loc[df["bvid"] == bvid, "has_subtitle"] = 1
-        df.loc[df["bvid"] == bvid, "subtitle_method"] = "whisper"
-        df.loc[df["bvid"] == bvid, "subtitle_count"] = seg_count
-        df.to_csv(INPUT_CSV, index=False, encoding="utf-8-sig")
-
-        # 删除音频（可选）
-        if DELETE_AUDIO_AFTER:
-            try:
-                os.remove(audio_path)
-                logging.info("已删除音频文件（节省空间）")
-            except Exception as e:
-                logging.warning(f"删除音频失败：{e}")
+    if TRANSCRIBE_WORKERS > 1:
+        processed = transcribe_in_pool(df, audio_stream, len(videos))
+    else:
+        # 预加载模型一次，提升批量效率（流水线模式下此时已在下载）
+        backend_name = asr_backends.resolve_backend(ASR_BACKEND)
+        logging.info(f"加载 {backend_name} 模型：{MODEL_SIZE}（首次可能较慢）")
+        backend = asr_backends.load_backend(backend_name, MODEL_SIZE, compute_type=COMPUTE_TYPE, cpu_threads=CPU_THREADS)
 
-        processed += 1
-        _rand_sleep(*SLEEP_BETWEEN)
+        processed = 0
+        for done, (bvid, title, audio) in enumerate(audio_stream, start=1):
+            logging.info("-" * 60)
+            logging.info(f"[{done}/{len(videos)}] 处理：{bvid} | {title[:60]}")
+            if audio_ok(bvid, audio) and transcribe_and_save(df, bvid, audio, backend):
+                processed += 1
 
     logging.info("-" * 60)
-    logging.info(f"任务完成：成功处理 {processed} 个视频")
+    logging.info(f"任务完成：成功处理 {processed} 个视频，总耗时 {time.time() - started:.0f} 秒")
     logging.info("=" * 60)
 
 if __name__ == "__main__":
@@ -8,6 +8,9 @@ from typing import Optional
 import pandas as pd
 import json
 
+import asr_backends
+from transcription_pool import TranscriptionPool
+
 INPUT_CSV = "outputs/01_video_index/videos_without_subtitle.csv"
 
 BASE_DIR = os.path.abspath(".")
@@ -18,6 +21,9 @@ JSON_DIR = os.path.join(OUT_DIR, "03_subtitles_json")
 LOG_DIR = os.path.join(OUT_DIR, "logs")
 
 MODEL_SIZE = "medium"
+ASR_BACKEND = "auto"       # whisper | faster-whisper | auto（见 asr_backends.py）
+TRANSCRIBE_WORKERS = 1     # >1 时用多进程转录池（见 transcription_pool.py），下载与转录并行
+THREADS_PER_WORKER = 4
 MAX_RETRIES = 3
 SLEEP_BETWEEN = (3, 7)
 
@@ -70,29 +76,9 @@ def download_audio_by_bvid(bvid: str, url: str) -> Optional[str]:
         _rand_sleep(*SLEEP_BETWEEN)
     return None
 
-def transcribe_with_timestamps(audio_path: str, model):
-    import whisper
+def transcribe_with_timestamps(audio_path: str, backend: asr_backends.ASRBackend):
     logging.info(f"开始转录：{os.path.basename(audio_path)}")
-    result = model.transcribe(
-        audio_path,
-        language="zh",
-        verbose=False,
-        initial_prompt="以下是一段中文视频的逐字转录。"
-    )
-    segments = result.get("segments", [])
-    
-    subtitles = []
-    for seg in segments:
-        text = str(seg.get("text", "")).strip()
-        if text:
-            subtitles.append({
-                "from": seg.get("start", 0),
-                "to": seg.get("end", 0),
-                "content": text,
-                "location": 2
-            })
-    
-    return subtitles
+    return backend.transcribe(audio_path)
 
 def save_json(bvid: str, subtitles: list) -> str:
     out_path = os.path.join(JSON_DIR, f"{bvid}_subtitle.json")
@@ -100,15 +86,58 @@ def save_json(bvid: str, subtitles: list) -> str:
         json.dump(subtitles, f, ensure_ascii=False, indent=2)
     return out_path
 
+def save_regenerated(df, bvid: str, audio_path: str, subtitles: list):
+    """
+    保存JSON、更新CSV、删除临时音频
+    """
+    out_json = save_json(bvid, subtitles)
+    logging.info(f"JSON 已保存：{out_json}（{len(subtitles)} 条字幕）")
+
+    df.loc[df["bvid"] == bvid, "subtitle_method"] = "whisper"
+    df.to_csv(INPUT_CSV, index=False, encoding="utf-8-sig")
+
+    try:
+        os.remove(audio_path)
+        logging.info("已删除临时音频文件")
+    except Exception as e:
+        logging.warning(f"删除音频失败：{e}")
+
+def regenerate_in_pool(df, rows) -> int:
+    """
+    多进程：逐个下载音频交给转录池，完成一个保存一个；返回成功数
+    """
+    def jobs():
+        for idx, row in enumerate(rows):
+            bvid = str(row.get("bvid", "")).strip()
+            url = str(row.get("url", f"https://www.bilibili.com/video/{bvid}")).strip()
+            logging.info(f"[{idx+1}/{len(rows)}] 下载：{bvid}")
+            audio_path = download_audio_by_bvid(bvid, url)
+            if not audio_path or not os.path.exists(audio_path):
+                logging.warning(f"{bvid} 音频下载失败，跳过")
+                continue
+            yield bvid, audio_path
+            _rand_sleep(*SLEEP_BETWEEN)
+
+    processed = 0
+    logging.info(f"多进程转录：{TRANSCRIBE_WORKERS} 个进程 × {THREADS_PER_WORKER} 线程")
+    with TranscriptionPool(ASR_BACKEND, MODEL_SIZE, TRANSCRIBE_WORKERS, THREADS_PER_WORKER) as pool:
+        for bvid, audio_path, subtitles, error in pool.run(jobs(), retries=MAX_RETRIES):
+            logging.info("-" * 60)
+            if error is not None:
+                logging.warning(f"{bvid} 转录失败，跳过：{error}")
+                continue
+            save_regenerated(df, bvid, audio_path, subtitles)
+            processed += 1
+    return processed
+
 def main():
     logging.info("=" * 60)
     logging.info("重新生成带时间戳的字幕文件")
     logging.info("=" * 60)
     
-    try:
-        import whisper
-    except Exception:
-        logging.error("未安装 openai-whisper，请先安装：pip install openai-whisper")
+    hint = asr_backends.missing_dependency(ASR_BACKEND)
+    if hint:
+        logging.error(f"未安装 {asr_backends.resolve_backend(ASR_BACKEND)}，请先安装：{hint}")
         sys.exit(1)
     
     if not os.path.exists(INPUT_CSV):
@@ -134,58 +163,50 @@ def main():
     
     logging.info(f"发现 {len(need_regenerate)} 个视频需要重新生成时间戳")
     
-    # 加载模型
-    logging.info(f"加载 Whisper 模型：{MODEL_SIZE}")
-    model = whisper.load_model(MODEL_SIZE)
-    
-    processed = 0
-    for idx, row in enumerate(need_regenerate):
-        bvid = str(row.get("bvid", "")).strip()
-        url = str(row.get("url", f"https://www.bilibili.com/video/{bvid}")).strip()
-        title = str(row.get("title", "")).strip()
-        
-        logging.info("-" * 60)
-        logging.info(f"[{idx+1}/{len(need_regenerate)}] 处理：{bvid} | {title[:60]}")
-        
-        # 下载音频
-        audio_path = download_audio_by_bvid(bvid, url)
-        if not audio_path or not os.path.exists(audio_path):
-            logging.warning(f"{bvid} 音频下载失败，跳过")
-            continue
+    if TRANSCRIBE_WORKERS > 1:
+        processed = regenerate_in_pool(df, need_regenerate)
+    else:
+        # 加载模型
+        logging.info(f"加载 {asr_backends.resolve_backend(ASR_BACKEND)} 模型：{MODEL_SIZE}")
+        backend = asr_backends.load_backend(ASR_BACKEND, MODEL_SIZE)
         
-        # 转录
-        ok = False
-        subtitles = []
-        for attempt in range(1, MAX_RETRIES + 1):
-            try:
-                subtitles = transcribe_with_timestamps(audio_path, model)
-                ok = True
-                break
-            except Exception as e:
-                logging.warning(f"转录失败（第 {attempt}/{MAX_RETRIES} 次）：{e}")
-                _rand_sleep(*SLEEP_BETWEEN)
-        
-        if not ok:
-            logging.warning(f"{bvid} 转录失败，跳过")
-            continue
-        
-        # 保存JSON
-        out_json = save_json(bvid, subtitles)
-        logging.info(f"JSON 已保存：{out_json}（{len(subtitles)} 条字幕）")
-        
-        # 更新CSV
-        df.loc[df["bvid"] == bvid, "subtitle_method"] = "whisper"
-        df.to_csv(INPUT_CSV, index=False, encoding="utf-8-sig")
-        
-        # 删除临时音频
-        try:
-            os.remove(audio_path)
-            logging.info("已删除临时音频文件")
-        except Exception as e:
-            logging.warning(f"删除音频失败：{e}")
-        
-        processed += 1
-        _rand_sleep(*SLEEP_BETWEEN)
+        processed = 0
+        for idx, row in enumerate(need_regenerate):
+            bvid = str(row.get("bvid", "")).strip()
+            url = str(row.get("url", f"https://www.bilibili.com/video/{bvid}")).strip()
+            title = str(row.get("title", "")).strip()
+            
+            logging.info("-" * 60)
+            logging.info(f"[{idx+1}/{len(need_regenerate)}] 处理：{bvid} | {title[:60]}")
+            
+            # 下载音频
+            audio_path = download_audio_by_bvid(bvid, url)
+            if not audio_path or not os.path.exists(audio_path):
+                logging.warning(f"{bvid} 音频下载失败，跳过")
+                continue
+            
+            # 转录
+            ok = False
+            subtitles = []
+            for attempt in range(1, MAX_RETRIES + 1):
+                try:
+                    subtitles = transcribe_with_timestamps(audio_path, backend)
+                    ok = True
+                    break
+                except Exception as e:
+                    logging.warning(f"转录失败（第 {attempt}/{MAX_RETRIES} 次）：{e}")
+                    _rand_sleep(*SLEEP_BETWEEN)
+            
+            if not ok:
+                logging.warning(f"{bvid} 转录失败，跳过")
+                continue
+            
+            # 保存JSON、更新CSV、删除临时音频
+            save_regenerated(df, bvid, audio_path, subtitles)
+            
+            processed += 1
+            _rand_sleep(*SLEEP_BETWEEN)
+    
     
     logging.info("-" * 60)
     logging.info(f"任务完成：成功重新生成 {processed} 个视频的时间戳")
@@ -1,19 +1,24 @@
-import json
 import os
+import sys
+import heapq
+import numpy as np
 import pandas as pd
 import glob
 from typing import List, Dict, Optional
+from subtitle_store import get_store
+from danmaku_schema import load_danmaku_csv, load_danmaku_parquet
+from danmaku_store import canonical_video_files
 
 def load_subtitle(bvid: str, json_dir: str = "Data") -> List[Dict]:
     """
-    加载带时间戳的字幕文件
+    加载带时间戳的字幕文件（经共享字幕缓存，每个视频只读取一次）
     """
-    json_path = os.path.join(json_dir, f"{bvid}_subtitle.json")
-    if not os.path.exists(json_path):
-        raise FileNotFoundError(f"未找到字幕文件: {json_path}")
+    store = get_store(json_dir)
+    video_subtitles = store.get(bvid)
+    if video_subtitles is None:
+        raise FileNotFoundError(f"未找到字幕文件: {store.path(bvid)}")
     
-    with open(json_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return video_subtitles.subtitles
 
 def find_subtitle_at_time(subtitles: List[Dict], time_seconds: float) -> Optional[Dict]:
     """
@@ -26,13 +31,101 @@ def find_subtitle_at_time(subtitles: List[Dict], time_seconds: float) -> Optiona
 
 def load_danmaku(danmaku_file: str) -> pd.DataFrame:
     """
-    加载弹幕数据
-    CSV格式: bvid, video_title, video_time_sec, text 等
+    加载弹幕数据：合并去重后的 Parquet 分区，或旧版 CSV
+    列: bvid, video_time_sec, mode, text 等（按 danmaku_schema 转为紧凑类型，标题列不再加载）
     """
     if not os.path.exists(danmaku_file):
         raise FileNotFoundError(f"未找到弹幕文件: {danmaku_file}")
     
-    return pd.read_csv(danmaku_file)
+    if danmaku_file.endswith('.parquet'):
+        return load_danmaku_parquet(danmaku_file)
+    return load_danmaku_csv(danmaku_file)
+
+def _first_covering(query_times: np.ndarray, sorted_from: np.ndarray, sorted_to: np.ndarray,
+                    order: np.ndarray) -> np.ndarray:
+    """
+    可能被多条字幕同时覆盖的时间点：按时间顺序扫描，堆中保存已开始的字幕（键为原列表下标）；
+    时间递增，堆顶字幕已结束就不会再覆盖后面的时间点，可直接弹出，剩下的堆顶即覆盖该点的最靠前字幕。
+    O((查询数 + 字幕数) log 字幕数)，长字幕或大量重叠字幕不会退化为逐条扫描
+    """
+    result = np.full(len(query_times), -1, dtype=np.int64)
+    heap = []
+    k = 0
+    for i in np.argsort(query_times, kind='stable'):
+        t = query_times[i]
+        while k < len(sorted_from) and sorted_from[k] <= t:
+            if not np.isnan(sorted_to[k]):
+                heapq.heappush(heap, (order[k], sorted_to[k]))
+            k += 1
+        while heap and heap[0][1] < t:
+            heapq.heappop(heap)
+        if heap:
+            result[i] = heap[0][0]
+    return result
+
+def match_times_to_subtitles(times, subtitles: List[Dict]) -> np.ndarray:
+    """
+    向量化的时间区间连接：为每个时间点返回所在字幕在 subtitles 中的下标（未命中为 -1）
+
+    字幕按 from 排序后用 searchsorted 定位候选字幕，一次处理整个视频的弹幕。
+    与 find_subtitle_at_time 语义一致：多条字幕同时覆盖某时间点时取列表中最靠前的一条。
+    """
+    times = np.asarray(times, dtype=float)
+    result = np.full(len(times), -1, dtype=np.int64)
+    if len(subtitles) == 0 or len(times) == 0:
+        return result
+
+    froms = np.array([sub['from'] for sub in subtitles], dtype=float)
+    tos = np.array([sub['to'] for sub in subtitles], dtype=float)
+    order = np.argsort(froms, kind='stable')
+    sorted_from = froms[order]
+    sorted_to = tos[order]
+    # 前缀最大 to，用于判断候选之前是否还有字幕覆盖同一时间点（重叠字幕）
+    prefix_max_to = np.maximum.accumulate(sorted_to)
+
+    valid = ~np.isnan(times)
+    pos = np.searchsorted(sorted_from, times, side='right') - 1
+    safe_pos = np.clip(pos, 0, None)
+    hit = valid & (pos >= 0) & (times <= sorted_to[safe_pos])
+    result[hit] = order[safe_pos[hit]]
+
+    # 重叠或首尾相接的字幕：候选之前仍有字幕覆盖该时间点，对这些时间点做一次扫描线求最靠前的覆盖字幕
+    prev_pos = np.clip(pos - 1, 0, None)
+    ambiguous = np.flatnonzero(valid & (pos >= 1) & (prefix_max_to[prev_pos] >= times))
+    if len(ambiguous):
+        result[ambiguous] = _first_covering(times[ambiguous], sorted_from, sorted_to, order)
+
+    return result
+
+def join_danmaku_subtitles(danmaku_df: pd.DataFrame, subtitles: List[Dict]) -> pd.DataFrame:
+    """
+    一次性将整段视频的弹幕与字幕对齐，输出列与逐条匹配时完全一致
+    """
+    matched_idx = match_times_to_subtitles(danmaku_df['video_time_sec'].to_numpy(), subtitles)
+    hit = matched_idx >= 0
+    safe_idx = np.clip(matched_idx, 0, None)
+
+    contents = np.array([sub['content'] for sub in subtitles] or [None], dtype=object)
+    froms = np.array([sub['from'] for sub in subtitles] or [None], dtype=object)
+    tos = np.array([sub['to'] for sub in subtitles] or [None], dtype=object)
+
+    columns = {
+        'danmaku_time': danmaku_df['video_time_sec'].to_numpy(),
+        'danmaku_content': danmaku_df['text'].to_numpy(),
+        'subtitle_content': np.where(hit, contents[safe_idx], None),
+        'subtitle_from': np.where(hit, froms[safe_idx], None),
+        'subtitle_to': np.where(hit, tos[safe_idx], None),
+    }
+    for col in danmaku_df.columns:
+        if col not in ['video_time_sec', 'text']:
+            # .array 保留 categorical 等紧凑类型
+            columns[f'danmaku_{col}'] = danmaku_df[col].array
+
+    result_df = pd.DataFrame(columns, index=danmaku_df.index)
+    # 与逐条构造 DataFrame 时的类型推断保持一致（数值列中的 None 变为 NaN）
+    for col in ['subtitle_from', 'subtitle_to']:
+        result_df[col] = pd.to_numeric(result_df[col])
+    return result_df
 
 def match_danmaku_with_subtitle(danmaku_file: str, bvid: str, output_file: Optional[str] = None):
     """
@@ -40,34 +133,27 @@ def match_danmaku_with_subtitle(danmaku_file: str, bvid: str, output_file: Optio
     """
     
     try:
-        subtitles = load_subtitle(bvid)
         danmaku_df = load_danmaku(danmaku_file)
     except FileNotFoundError as e:
         return None
     
-    
-    results = []
-    for idx, row in danmaku_df.iterrows():
-        danmaku_time = row['video_time_sec']
-        danmaku_content = row['text']
-        
-        matched_subtitle = find_subtitle_at_time(subtitles, danmaku_time)
-        
-        result = {
-            'danmaku_time': danmaku_time,
-            'danmaku_content': danmaku_content,
-            'subtitle_content': matched_subtitle['content'] if matched_subtitle else None,
-            'subtitle_from': matched_subtitle['from'] if matched_subtitle else None,
-            'subtitle_to': matched_subtitle['to'] if matched_subtitle else None,
-        }
-        
-        for col in danmaku_df.columns:
-            if col not in ['video_time_sec', 'text']:
-                result[f'danmaku_{col}'] = row[col]
-        
-        results.append(result)
-    
-    result_df = pd.DataFrame(results)
+    if 'page' in danmaku_df.columns and danmaku_df['page'].nunique() > 1:
+        # 多P视频：每个分P的弹幕与该分P自己的字幕（P1 为 {bvid}_subtitle.json，其余为 {bvid}_p{n}_subtitle.json）对齐；
+        # 某个分P缺字幕只影响该分P
+        parts = []
+        for page, page_df in danmaku_df.groupby('page', sort=False):
+            try:
+                page_subtitles = load_subtitle(bvid if page == 1 else f"{bvid}_p{page}")
+            except FileNotFoundError:
+                page_subtitles = []
+            parts.append(join_danmaku_subtitles(page_df, page_subtitles))
+        result_df = pd.concat(parts).sort_index().reset_index(drop=True)
+    else:
+        try:
+            subtitles = load_subtitle(bvid)
+        except FileNotFoundError as e:
+            return None
+        result_df = join_danmaku_subtitles(danmaku_df, subtitles).reset_index(drop=True)
     
     if output_file:
         result_df.to_csv(output_file, index=False, encoding='utf-8-sig')
@@ -77,6 +163,21 @@ def match_danmaku_with_subtitle(danmaku_file: str, bvid: str, output_file: Optio
     
     return result_df, matched_count, match_rate
 
+def verify_vectorized_match(danmaku_df: pd.DataFrame, subtitles: List[Dict]) -> bool:
+    """
+    正确性检查：将向量化连接结果与逐条调用 find_subtitle_at_time 的结果逐行比对
+    """
+    matched_idx = match_times_to_subtitles(danmaku_df['video_time_sec'].to_numpy(), subtitles)
+    mismatches = 0
+    for i, danmaku_time in enumerate(danmaku_df['video_time_sec']):
+        expected = find_subtitle_at_time(subtitles, danmaku_time)
+        actual = subtitles[matched_idx[i]] if matched_idx[i] >= 0 else None
+        if expected is not actual:
+            mismatches += 1
+            if mismatches <= 5:
+                print(f"  [MISMATCH] t={danmaku_time}: 期望 {expected}，实际 {actual}")
+    return mismatches == 0
+
 def analyze_danmaku_by_subtitle(result_df: pd.DataFrame):
     """
     按字幕内容分组分析弹幕
@@ -127,20 +228,35 @@ if __name__ == "__main__":
     
     os.makedirs(output_dir, exist_ok=True)
     
-    danmaku_files = glob.glob(os.path.join(danmaku_dir, "*.csv"))
-    danmaku_files = [f for f in danmaku_files if not os.path.basename(f).startswith("all_")]
+    # 优先读取合并去重后的规范数据集（每个视频一个分区，见 danmaku_store.py），否则退回旧版逐视频 CSV
+    video_files = canonical_video_files(danmaku_dir)
+    if not video_files:
+        danmaku_files = glob.glob(os.path.join(danmaku_dir, "*.csv"))
+        danmaku_files = [f for f in danmaku_files if not os.path.basename(f).startswith("all_")]
+        video_files = [(os.path.basename(f).split('_')[0], f) for f in danmaku_files]
+    
+    print(f"发现 {len(video_files)} 个弹幕文件")
     
-    print(f"发现 {len(danmaku_files)} 个弹幕文件")
+    # python 07_danmaku_subtitle_matching.py --verify：只做向量化匹配与逐条匹配的一致性检查
+    if '--verify' in sys.argv:
+        verified = 0
+        for bvid, danmaku_file in video_files:
+            try:
+                subtitles = load_subtitle(bvid, subtitle_dir)
+            except FileNotFoundError:
+                continue
+            ok = verify_vectorized_match(load_danmaku(danmaku_file), subtitles)
+            verified += ok
+            print(f"[{'OK' if ok else 'DIFF'}] {bvid}")
+        print(f"\n一致性检查完成: {verified} 个视频结果一致")
+        sys.exit(0)
     
     success_count = 0
     fail_count = 0
     total_matched = 0
     total_danmaku = 0
     
-    for danmaku_file in danmaku_files:
-        filename = os.path.basename(danmaku_file)
-        bvid = filename.split('_')[0]
-        
+    for bvid, danmaku_file in video_files:
         try:
             result = match_danmaku_with_subtitle(
                 danmaku_file=danmaku_file,
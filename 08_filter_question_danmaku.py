@@ -1,132 +1,298 @@
-import json
 import os
 import pandas as pd
 import glob
-from typing import List, Dict
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Tuple
+from subtitle_store import get_store
+from question_events import QuestionEvents, QuestionEventWriter
+from danmaku_schema import load_matched_csv
+
+# 问号风暴检测参数
+STORM_BIN_SECONDS = 1          # 计数分箱宽度（秒）
+STORM_WINDOW_SECONDS = 5       # 滑动窗口长度（秒）
+STORM_MIN_COUNT = 3            # 窗口内问号弹幕数达到该值即视为风暴
+STORM_MERGE_GAP = 2            # 相邻风暴间隔不超过该秒数时合并
 
 def load_matched_data(matched_file: str) -> pd.DataFrame:
     """
-    加载已匹配的弹幕字幕数据
+    加载已匹配的弹幕字幕数据（按 danmaku_schema 转为紧凑类型）
     """
-    return pd.read_csv(matched_file)
+    return load_matched_csv(matched_file)
 
 def get_subtitles_in_window(bvid: str, center_time: float, window_seconds: float = 15, 
                             subtitle_dir: str = "Data") -> List[Dict]:
     """
-    获取指定时间前后window_seconds秒内的所有字幕
+    获取指定时间前后window_seconds秒内的所有字幕（字幕文件经共享缓存只解析一次）
     """
-    json_path = os.path.join(subtitle_dir, f"{bvid}_subtitle.json")
-    if not os.path.exists(json_path):
-        return []
-    
-    with open(json_path, 'r', encoding='utf-8') as f:
-        subtitles = json.load(f)
-    
-    start_time = center_time - window_seconds
-    end_time = center_time + window_seconds
-    
-    result = []
-    for sub in subtitles:
-        if (sub['from'] >= start_time and sub['from'] <= end_time) or \
-           (sub['to'] >= start_time and sub['to'] <= end_time) or \
-           (sub['from'] <= start_time and sub['to'] >= end_time):
-            result.append({
-                'from': sub['from'],
-                'to': sub['to'],
-                'content': sub['content'],
-                'time_diff': sub['from'] - center_time
-            })
-    
-    return result
+    return get_store(subtitle_dir).window(bvid, center_time, window_seconds)
 
-def get_danmaku_in_window(df: pd.DataFrame, center_time: float, window_seconds: float = 15) -> pd.DataFrame:
+def build_time_index(df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    为单个视频的弹幕建立时间索引：返回 (按时间排序的 danmaku_time 数组, 对应的行位置)
+    """
+    times = df['danmaku_time'].to_numpy(dtype=float)
+    order = np.argsort(times, kind='stable')
+    return times[order], order
+
+def get_window_bounds(time_index: Tuple[np.ndarray, np.ndarray], center_time: float,
+                      window_seconds: float) -> Tuple[int, int]:
+    """
+    返回窗口 [center_time - window_seconds, center_time + window_seconds] 在排序后弹幕中的 [lo, hi) 区间
+    """
+    sorted_times, _ = time_index
+    lo = np.searchsorted(sorted_times, center_time - window_seconds, side='left')
+    hi = np.searchsorted(sorted_times, center_time + window_seconds, side='right')
+    return int(lo), int(hi)
+
+def get_danmaku_in_window(df: pd.DataFrame, center_time: float, window_seconds: float = 15,
+                          time_index: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> pd.DataFrame:
     """
     获取指定时间前后window_seconds秒内的所有弹幕
+
+    传入 build_time_index 的结果时，用二分查找定位窗口边界，不再扫描整张表
     """
     start_time = center_time - window_seconds
     end_time = center_time + window_seconds
     
-    window_df = df[(df['danmaku_time'] >= start_time) & (df['danmaku_time'] <= end_time)].copy()
+    if time_index is None:
+        window_df = df[(df['danmaku_time'] >= start_time) & (df['danmaku_time'] <= end_time)].copy()
+    else:
+        _, order = time_index
+        lo, hi = get_window_bounds(time_index, center_time, window_seconds)
+        # 保持与布尔筛选相同的行顺序
+        window_df = df.iloc[np.sort(order[lo:hi])].copy()
     window_df['time_diff'] = window_df['danmaku_time'] - center_time
     
     return window_df
 
+def _kleinberg_burst_bins(counts: np.ndarray, s: float = 2.0, gamma: float = 1.0) -> np.ndarray:
+    """
+    Kleinberg 双状态突发模型：用 Viterbi 求每个分箱处于"突发"状态的最优序列
+    """
+    n = len(counts)
+    base_rate = max(counts.mean(), 1e-6)
+    rates = np.array([base_rate, base_rate * s])
+    # 泊松负对数似然（省略与状态无关的 log(c!) 项）
+    emit = rates[None, :] - counts[:, None] * np.log(rates)[None, :]
+    up_cost = gamma * np.log(max(n, 2))
+
+    cost = np.array([emit[0, 0], emit[0, 1] + up_cost])
+    back = np.zeros((n, 2), dtype=np.int8)
+    for i in range(1, n):
+        stay_low, from_high = cost[0], cost[1]
+        back[i, 0] = 0 if stay_low <= from_high else 1
+        low = min(stay_low, from_high)
+        stay_high, from_low = cost[1], cost[0] + up_cost
+        back[i, 1] = 1 if stay_high <= from_low else 0
+        high = min(stay_high, from_low)
+        cost = np.array([low, high]) + emit[i]
+
+    states = np.zeros(n, dtype=np.int8)
+    states[-1] = int(np.argmin(cost))
+    for i in range(n - 1, 0, -1):
+        states[i - 1] = back[i, states[i]]
+    return states == 1
+
+def detect_question_storms(question_times, bin_seconds: float = STORM_BIN_SECONDS,
+                           window_seconds: float = STORM_WINDOW_SECONDS,
+                           min_count: int = STORM_MIN_COUNT,
+                           merge_gap: float = STORM_MERGE_GAP,
+                           method: str = "threshold") -> List[Dict]:
+    """
+    将问号弹幕按秒分箱并检测突发的"问号风暴"
+
+    method="threshold"：任意 window_seconds 秒滑动窗口内问号数 >= min_count 的区段
+    method="kleinberg"：Kleinberg 双状态突发模型判定的高频区段
+    返回每个风暴的起止时间、峰值分箱起点、峰值速率（条/秒）与问号数
+    """
+    times = np.sort(np.asarray(question_times, dtype=float))
+    times = times[~np.isnan(times)]
+    if len(times) == 0:
+        return []
+
+    origin = np.floor(times[0] / bin_seconds) * bin_seconds
+    bins = ((times - origin) // bin_seconds).astype(np.int64)
+    counts = np.bincount(bins)
+
+    if method == "kleinberg":
+        active = _kleinberg_burst_bins(counts) & (counts > 0)
+    else:
+        width = max(int(round(window_seconds / bin_seconds)), 1)
+        # window_sums[j]：从第 j 个分箱开始的窗口内问号数
+        window_sums = np.convolve(counts, np.ones(width, dtype=np.int64))[width - 1:]
+        dense_starts = (window_sums >= min_count).astype(np.int64)
+        covered = np.convolve(dense_starts, np.ones(width, dtype=np.int64))[:len(counts)] > 0
+        active = covered & (counts > 0)
+
+    active_bins = np.flatnonzero(active)
+    if len(active_bins) == 0:
+        return []
+
+    max_gap_bins = int(round(merge_gap / bin_seconds)) + 1
+    split_points = np.flatnonzero(np.diff(active_bins) > max_gap_bins) + 1
+
+    storms = []
+    for group in np.split(active_bins, split_points):
+        first_bin, last_bin = group[0], group[-1]
+        in_storm = (bins >= first_bin) & (bins <= last_bin)
+        question_count = int(in_storm.sum())
+        if question_count < min_count:
+            continue
+        storm_counts = counts[first_bin:last_bin + 1]
+        peak_bin = first_bin + int(np.argmax(storm_counts))
+        storm_times = times[in_storm]
+        storms.append({
+            'start': float(storm_times[0]),
+            'end': float(storm_times[-1]),
+            'peak_time': float(origin + peak_bin * bin_seconds),
+            'peak_rate': float(storm_counts.max() / bin_seconds),
+            'question_count': question_count
+        })
+    return storms
+
+def question_windows(question_danmaku: pd.DataFrame, window_seconds: float,
+                     event_mode: str = "storm", storm_method: str = "threshold") -> List[Tuple]:
+    """
+    一组问号弹幕（同一视频的同一分P）的事件窗口：[(代表问号弹幕, 窗口中心, 窗口半宽, 附加字段)]
+    """
+    windows = []
+    if event_mode == "storm":
+        storms = detect_question_storms(question_danmaku['danmaku_time'], method=storm_method)
+        for storm in storms:
+            # 以峰值分箱中的第一条问号弹幕作为该风暴的代表
+            peak_rows = question_danmaku[question_danmaku['danmaku_time'] >= storm['peak_time']]
+            question_row = peak_rows.sort_values('danmaku_time', kind='stable').iloc[0]
+            windows.append((
+                question_row,
+                (storm['start'] + storm['end']) / 2,
+                (storm['end'] - storm['start']) / 2 + window_seconds,
+                {
+                    'storm_start': storm['start'],
+                    'storm_end': storm['end'],
+                    'storm_peak_rate': storm['peak_rate'],
+                    'storm_question_count': storm['question_count'],
+                }
+            ))
+        # 不属于任何风暴的零星问号弹幕各自作为一条结果，不被丢弃
+        question_times = question_danmaku['danmaku_time'].to_numpy(dtype=float)
+        in_storm = np.zeros(len(question_danmaku), dtype=bool)
+        for storm in storms:
+            in_storm |= (question_times >= storm['start']) & (question_times <= storm['end'])
+        for idx, question_row in question_danmaku[~in_storm].iterrows():
+            windows.append((question_row, question_row['danmaku_time'], window_seconds, {}))
+        windows.sort(key=lambda window: window[1])
+    else:
+        for idx, question_row in question_danmaku.iterrows():
+            windows.append((question_row, question_row['danmaku_time'], window_seconds, {}))
+
+    return windows
+
 def filter_question_danmaku(matched_dir: str = "matched_results", 
                            output_dir: str = "question_analysis",
-                           window_seconds: float = 15):
+                           window_seconds: float = 15,
+                           event_mode: str = "storm",
+                           storm_method: str = "threshold"):
     """
     筛选包含"？"的弹幕及其周围的弹幕和字幕
+
+    event_mode="storm"：每个问号风暴输出一条结果，上下文为风暴起止时间前后 window_seconds 秒；
+                      未达到风暴阈值的零星问号弹幕仍各自输出一条结果（同 row 模式）
+    event_mode="row"：每条问号弹幕输出一条结果（旧行为，风暴内上下文大量重叠）
+
+    结果按视频增量写入 question_events.jsonl 与 danmaku/{bvid}.jsonl（格式见 question_events.py），
+    上下文弹幕以行号区间引用共享弹幕表，可用 iter_question_events 流式读取
+
+    返回 (results, summary_df)：results 为 QuestionEvents，可求 len 与多次迭代（从磁盘流式还原事件），
+    不再是内存中的列表
     """
     os.makedirs(output_dir, exist_ok=True)
     
     matched_files = glob.glob(os.path.join(matched_dir, "*_matched.csv"))
     
-    all_results = []
+    summary_data = []
     
-    for matched_file in matched_files:
-        filename = os.path.basename(matched_file)
-        bvid = filename.replace("_matched.csv", "")
-        
-        try:
-            df = load_matched_data(matched_file)
-            
-            if len(df) == 0 or 'danmaku_content' not in df.columns:
-                continue
-            
-            question_danmaku = df[df['danmaku_content'].astype(str).str.contains('？', na=False)]
+    with QuestionEventWriter(output_dir) as writer:
+        for matched_file in matched_files:
+            filename = os.path.basename(matched_file)
+            bvid = filename.replace("_matched.csv", "")
             
-            if len(question_danmaku) == 0:
-                continue
-            
-            for idx, question_row in question_danmaku.iterrows():
-                center_time = question_row['danmaku_time']
+            try:
+                df = load_matched_data(matched_file)
                 
-                nearby_danmaku = get_danmaku_in_window(df, center_time, window_seconds)
-                nearby_subtitles = get_subtitles_in_window(bvid, center_time, window_seconds)
+                if len(df) == 0 or 'danmaku_content' not in df.columns:
+                    continue
                 
-                result = {
-                    'bvid': bvid,
-                    'question_danmaku': question_row['danmaku_content'],
-                    'question_time': center_time,
-                    'question_subtitle': question_row['subtitle_content'],
-                    'nearby_danmaku_count': len(nearby_danmaku),
-                    'nearby_subtitle_count': len(nearby_subtitles),
-                    'nearby_danmaku': nearby_danmaku.to_dict('records'),
-                    'nearby_subtitles': nearby_subtitles
-                }
+                is_question = df['danmaku_content'].astype(str).str.contains('？', na=False)
+                question_danmaku = df[is_question]
                 
-                all_results.append(result)
-        
-        except Exception as e:
-            print(f"[ERROR] {bvid}: {str(e)}")
-            continue
-    
-    with open(os.path.join(output_dir, "question_danmaku_analysis.json"), 'w', encoding='utf-8') as f:
-        json.dump(all_results, f, ensure_ascii=False, indent=2)
-    
-    summary_data = []
-    for result in all_results:
-        summary_data.append({
-            'bvid': result['bvid'],
-            'question_danmaku': result['question_danmaku'],
-            'question_time': result['question_time'],
-            'question_subtitle': result['question_subtitle'],
-            'nearby_danmaku_count': result['nearby_danmaku_count'],
-            'nearby_subtitle_count': result['nearby_subtitle_count']
-        })
+                if len(question_danmaku) == 0:
+                    continue
+                
+                # 多P视频的 danmaku_time 是各分P内的本地时间：共享弹幕表按 (分P, 时间) 排序，
+                # 风暴检测、上下文窗口与字幕（{bvid}_p{n}）都在各分P内分别计算
+                pages = (df['danmaku_page'] if 'danmaku_page' in df.columns
+                         else pd.Series(1, index=df.index)).to_numpy()
+                times = df['danmaku_time'].to_numpy(dtype=float)
+                order = np.lexsort((times, pages))
+                sorted_pages = pages[order]
+                question_pages = pages[is_question.to_numpy()]
+                
+                events = []
+                for page in np.unique(question_pages):
+                    start = int(np.searchsorted(sorted_pages, page, side='left'))
+                    stop = int(np.searchsorted(sorted_pages, page, side='right'))
+                    page_index = (times[order[start:stop]], order[start:stop])
+                    subtitle_key = bvid if page == 1 else f"{bvid}_p{page}"
+                    page_questions = question_danmaku[question_pages == page]
+                    
+                    for question_row, center_time, half_width, extra in question_windows(
+                            page_questions, window_seconds, event_mode, storm_method):
+                        lo, hi = get_window_bounds(page_index, center_time, half_width)
+                        nearby_subtitles = get_subtitles_in_window(subtitle_key, center_time, half_width)
+                        
+                        events.append({
+                            'bvid': bvid,
+                            'page': int(page),
+                            'question_danmaku': question_row['danmaku_content'],
+                            'question_time': question_row['danmaku_time'],
+                            'question_subtitle': question_row['subtitle_content'],
+                            **extra,
+                            'window_center': center_time,
+                            'window_seconds': half_width,
+                            'nearby_danmaku_count': hi - lo,
+                            'nearby_subtitle_count': len(nearby_subtitles),
+                            'danmaku_rows': [start + lo, start + hi],
+                            'nearby_subtitles': nearby_subtitles
+                        })
+                
+                writer.write_video(bvid, df.iloc[order], events)
+                
+                for event in events:
+                    summary_data.append({
+                        key: value for key, value in event.items()
+                        if key not in ('window_center', 'window_seconds', 'danmaku_rows', 'nearby_subtitles')
+                    })
+            
+            except Exception as e:
+                print(f"[ERROR] {bvid}: {str(e)}")
+                continue
     
     summary_df = pd.DataFrame(summary_data)
     summary_df.to_csv(os.path.join(output_dir, "question_danmaku_summary.csv"), 
                      index=False, encoding='utf-8-sig')
     
-    print(f"筛选完成: 共找到 {len(all_results)} 条包含问号的弹幕")
+    if event_mode == "storm":
+        storm_count = int(summary_df['storm_start'].notna().sum()) if 'storm_start' in summary_df else 0
+        print(f"筛选完成: 共检测到 {storm_count} 个问号风暴，{len(summary_df) - storm_count} 条零星问号弹幕")
+    else:
+        print(f"筛选完成: 共找到 {len(summary_df)} 条包含问号的弹幕")
     print(f"结果已保存到 {output_dir} 目录")
     
-    return all_results, summary_df
+    return QuestionEvents(output_dir, writer.event_count), summary_df
 
-def export_detailed_context(results: List[Dict], output_dir: str = "question_analysis"):
+def export_detailed_context(results: Iterable[Dict], output_dir: str = "question_analysis"):
     """
-    导出每个问号弹幕的详细上下文到单独的文本文件
+    导出每个问号弹幕的详细上下文到单独的文本文件（results 可为 iter_question_events 的流式结果）
     """
     context_dir = os.path.join(output_dir, "detailed_contexts")
     os.makedirs(context_dir, exist_ok=True)
@@ -137,11 +303,22 @@ def export_detailed_context(results: List[Dict], output_dir: str = "question_ana
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(f"视频: {result['bvid']}\n")
             f.write(f"问号弹幕: {result['question_danmaku']}\n")
+            if result.get('page', 1) > 1:
+                f.write(f"分P: P{result['page']}\n")
             f.write(f"时间: {result['question_time']:.2f}秒\n")
             f.write(f"对应字幕: {result['question_subtitle']}\n")
+            if 'storm_start' in result:
+                f.write(f"风暴区间: {result['storm_start']:.2f}秒 - {result['storm_end']:.2f}秒 "
+                        f"(问号 {result['storm_question_count']} 条, 峰值 {result['storm_peak_rate']:.1f} 条/秒)\n")
             f.write(f"\n{'='*60}\n")
             
-            f.write(f"\n前后15秒的字幕内容:\n")
+            # 上下文窗口：问号弹幕前后 window_seconds 秒；风暴的窗口半宽含风暴本身的一半，换算回风暴区间前后的秒数
+            half_width = result.get('window_seconds', 15)
+            if 'storm_start' in result:
+                window = f"风暴区间前后{half_width - (result['storm_end'] - result['storm_start']) / 2:g}秒"
+            else:
+                window = f"前后{half_width:g}秒"
+            f.write(f"\n{window}的字幕内容:\n")
             f.write(f"{'-'*60}\n")
             sorted_subtitles = sorted(result['nearby_subtitles'], key=lambda x: x['from'])
             for sub in sorted_subtitles:
@@ -149,7 +326,7 @@ def export_detailed_context(results: List[Dict], output_dir: str = "question_ana
                 f.write(f"{time_str} {sub['content']}\n")
             
             f.write(f"\n{'='*60}\n")
-            f.write(f"\n前后15秒的弹幕内容 (共{result['nearby_danmaku_count']}条):\n")
+            f.write(f"\n{window}的弹幕内容 (共{result['nearby_danmaku_count']}条):\n")
             f.write(f"{'-'*60}\n")
             sorted_danmaku = sorted(result['nearby_danmaku'], key=lambda x: x['danmaku_time'])
             for dm in sorted_danmaku:
@@ -161,7 +338,8 @@ if __name__ == "__main__":
     results, summary_df = filter_question_danmaku(
         matched_dir="matched_results",
         output_dir="question_analysis",
-        window_seconds=10
+        window_seconds=10,
+        event_mode="storm"
     )
     
     if len(results) > 0:
@@ -169,6 +347,6 @@ if __name__ == "__main__":
         print(f"\n详细上下文已导出到 question_analysis/detailed_contexts/ 目录")
         
         print(f"\n统计信息:")
-        print(f"平均每个问号弹幕周围有 {summary_df['nearby_danmaku_count'].mean():.1f} 条弹幕")
-        print(f"平均每个问号弹幕周围有 {summary_df['nearby_subtitle_count'].mean():.1f} 条字幕")
+        print(f"平均每个问号风暴周围有 {summary_df['nearby_danmaku_count'].mean():.1f} 条弹幕")
+        print(f"平均每个问号风暴周围有 {summary_df['nearby_subtitle_count'].mean():.1f} 条字幕")
 
@@ -3,6 +3,7 @@ import pandas as pd
 import os
 import jieba
 import urllib.request
+from question_events import iter_question_events
 
 def download_stopwords():
     """下载并合并中文停用词"""
@@ -33,7 +34,18 @@ def segment_text(text, stopwords):
     filtered_words = [w for w in words if w.strip() and w not in stopwords]
     return ' '.join(filtered_words)
 
-def prepare_lda_data(analysis_file: str = "question_analysis/question_danmaku_analysis.json",
+def load_analysis_results(analysis_path: str):
+    """
+    读取08的分析结果：目录为规范化的 JSON Lines 格式（流式逐条读取），
+    .json 文件为旧版 question_danmaku_analysis.json（整体载入）
+    """
+    if analysis_path.endswith('.json'):
+        with open(analysis_path, 'r', encoding='utf-8') as f:
+            yield from json.load(f)
+    else:
+        yield from iter_question_events(analysis_path)
+
+def prepare_lda_data(analysis_file: str = "question_analysis",
                      output_dir: str = "lda_analysis"):
     os.makedirs(output_dir, exist_ok=True)
     
@@ -43,8 +55,7 @@ def prepare_lda_data(analysis_file: str = "question_analysis/question_danmaku_an
         with open("stopwords_zh_combined.txt", 'r', encoding='utf-8') as f:
             stopwords = set(f.read().strip().split('\n'))
     
-    with open(analysis_file, 'r', encoding='utf-8') as f:
-        results = json.load(f)
+    results = load_analysis_results(analysis_file)
     
     subtitle_texts = []
     danmaku_texts = []
@@ -0,0 +1,157 @@
+"""
+语音识别后端（05、06 共用）
+- whisper：openai-whisper（PyTorch，fp32；有 CUDA 时在 GPU 上运行）
+- faster-whisper：CTranslate2 引擎，CPU 上使用 int8 量化，速度为 PyTorch fp32 的数倍
+
+两个后端输出同一字幕格式（兼容B站字幕）：
+    [{"from": 0.0, "to": 2.5, "content": "大家好", "location": 2}, ...]
+
+选择方式：load_backend("whisper" | "faster-whisper" | "auto")；
+auto 在有 CUDA 时用 whisper，否则优先 faster-whisper（未安装时回退 whisper）
+"""
+
+import os
+import subprocess
+from typing import Dict, Iterator, List, Optional, Tuple
+
+LANGUAGE = "zh"
+INITIAL_PROMPT = "以下是一段中文视频的逐字转录。"
+SUBTITLE_LOCATION = 2     # B站字幕格式：2表示底部居中
+SAMPLE_RATE = 16000       # 模型输入：16 kHz 单声道 float32
+
+# 后端名 -> (Python 包, 安装提示)
+BACKEND_PACKAGES = {
+    "whisper": ("whisper", "pip install openai-whisper torch"),
+    "faster-whisper": ("faster_whisper", "pip install faster-whisper"),
+}
+
+
+class ASRBackend:
+    """
+    后端接口：子类实现 _segments，产出 (start, end, text)
+    """
+
+    name = "base"
+
+    def _segments(self, audio) -> Iterator[Tuple[float, float, str]]:
+        raise NotImplementedError
+
+    def transcribe(self, audio) -> List[Dict]:
+        """
+        audio：音频文件路径、原始 PCM 文件（.f32，内存映射）或 16 kHz 单声道 float32 数组；
+        返回字幕列表（空白段落已去除）
+        """
+        if isinstance(audio, str) and audio.endswith(".f32"):
+            import numpy as np
+            audio = np.memmap(audio, dtype=np.float32, mode="c")
+        subtitles = []
+        for start, end, text in self._segments(audio):
+            text = str(text).strip()
+            if text:
+                subtitles.append({
+                    "from": float(start),
+                    "to": float(end),
+                    "content": text,
+                    "location": SUBTITLE_LOCATION
+                })
+        return subtitles
+
+
+class WhisperBackend(ASRBackend):
+    """
+    openai-whisper
+    """
+
+    name = "whisper"
+
+    def __init__(self, model_size: str, device: Optional[str] = None, **_):
+        import whisper
+        self.model = whisper.load_model(model_size, device=device)
+
+    def _segments(self, audio):
+        result = self.model.transcribe(audio, language=LANGUAGE, verbose=False, initial_prompt=INITIAL_PROMPT)
+        for seg in result.get("segments", []):
+            yield seg.get("start", 0), seg.get("end", 0), seg.get("text", "")
+
+
+class FasterWhisperBackend(ASRBackend):
+    """
+    faster-whisper（CTranslate2）；默认 int8（CPU 与 GPU 均可），cpu_threads=0 表示由 CTranslate2 自动决定
+    """
+
+    name = "faster-whisper"
+
+    def __init__(self, model_size: str, device: str = "auto", compute_type: str = "int8",
+                 cpu_threads: int = 0, **_):
+        from faster_whisper import WhisperModel
+        self.model = WhisperModel(model_size, device=device, compute_type=compute_type, cpu_threads=cpu_threads)
+
+    def _segments(self, audio):
+        segments, _ = self.model.transcribe(audio, language=LANGUAGE, initial_prompt=INITIAL_PROMPT)
+        for seg in segments:
+            yield seg.start, seg.end, seg.text
+
+
+BACKENDS = {
+    "whisper": WhisperBackend,
+    "faster-whisper": FasterWhisperBackend,
+}
+
+
+def cuda_available() -> bool:
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except Exception:
+        return False
+
+
+def is_installed(name: str) -> bool:
+    import importlib.util
+    return importlib.util.find_spec(BACKEND_PACKAGES[name][0]) is not None
+
+
+def resolve_backend(name: str = "auto") -> str:
+    """
+    auto -> 具体后端名；其余原样返回（未知名称抛出 ValueError）
+    """
+    if name == "auto":
+        if cuda_available() or not is_installed("faster-whisper"):
+            return "whisper"
+        return "faster-whisper"
+    if name not in BACKENDS:
+        raise ValueError(f"未知 ASR 后端：{name}（可选：auto, {', '.join(BACKENDS)}）")
+    return name
+
+
+def missing_dependency(name: str = "auto") -> Optional[str]:
+    """
+    后端所需的包未安装时返回安装提示，否则返回 None
+    """
+    name = resolve_backend(name)
+    return None if is_installed(name) else BACKEND_PACKAGES[name][1]
+
+
+def audio_duration(audio) -> float:
+    """
+    音频时长（秒）：数组与 .f32 按采样数计算，其余文件用 ffprobe；无法获取时返回 0
+    """
+    if not isinstance(audio, str):
+        return len(audio) / SAMPLE_RATE
+    if audio.endswith(".f32"):
+        return os.path.getsize(audio) / 4 / SAMPLE_RATE
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", audio],
+            capture_output=True, text=True, check=True
+        ).stdout
+        return float(out.strip())
+    except Exception:
+        return 0.0
+
+
+def load_backend(name: str = "auto", model_size: str = "medium", **options) -> ASRBackend:
+    """
+    加载后端与模型（每个进程只需一次）；options 传给具体后端（device、compute_type、cpu_threads）
+    """
+    return BACKENDS[resolve_backend(name)](model_size, **options)
@@ -0,0 +1,208 @@
+"""
+Offline throughput benchmark for the crawler stages (01, 02, 04)
+Starts fake_bilibili_server, then runs each crawler mode against it in a fresh
+subprocess and working directory, so every run starts with empty caches and
+state and has its own peak-memory figure. Reports videos completed and failed
+(out of --videos), videos per minute, peak RSS, requests / injected 412s served
+and the adaptive rate the crawler ended at. A run where videos failed is not a
+valid throughput figure: the failed videos did not do the work.
+
+    python benchmark_crawlers.py --videos 40 --latency 50 --throttle 0,0.05,0.2
+    python benchmark_crawlers.py --scenarios 02_xml_async,04_async --danmaku 20000 --output bench.json
+
+03 is not included: it talks to Bilibili through bilibili_api's own client,
+which cannot be pointed at the local server.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# scenario -> (script, module attribute overrides)
+SCENARIOS = {
+    '01_search': ('01_search.py', {}),
+    '02_xml_async': ('02_danmakucrawling.py', {'CRAWL_MODE': 'async', 'DANMAKU_SOURCE': 'xml'}),
+    '02_xml_serial': ('02_danmakucrawling.py', {'CRAWL_MODE': 'serial', 'DANMAKU_SOURCE': 'xml'}),
+    '02_segment_async': ('02_danmakucrawling.py', {'CRAWL_MODE': 'async', 'DANMAKU_SOURCE': 'segment'}),
+    '02_history_async': ('02_danmakucrawling.py', {'CRAWL_MODE': 'async', 'DANMAKU_SOURCE': 'history'}),
+    '04_async': ('04_get_subtitles.py', {}),
+    # 04 has no serial mode; this is the async harvester with one video in flight
+    '04_async_1video': ('04_get_subtitles.py', {'MAX_CONCURRENT_VIDEOS': 1}),
+}
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process (None where the resource module is unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+def load_stage(script):
+    spec = importlib.util.spec_from_file_location(os.path.splitext(script)[0], os.path.join(REPO_DIR, script))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def point_at(module, base_url):
+    """Redirect every endpoint constant of a stage (and the shared view API) to the fake server"""
+    import video_meta
+    video_meta.VIEW_API = f"{base_url}/x/web-interface/view"
+    endpoints = {
+        'NAV_API': '/x/web-interface/nav',
+        'SEARCH_API': '/x/web-interface/wbi/search/type',
+        'XML_API': '/x/v1/dm/list.so',
+        'SEGMENT_API': '/x/v2/dm/web/seg.so',
+        'HISTORY_INDEX_API': '/x/v2/dm/history/index',
+        'HISTORY_SEG_API': '/x/v2/dm/web/history/seg.so',
+        'PLAYER_API': '/x/player/v2',
+    }
+    for name, path in endpoints.items():
+        if hasattr(module, name):
+            setattr(module, name, base_url + path)
+
+
+def run_worker(args):
+    """Run one scenario in this (fresh) process and print its result as JSON"""
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(args.workdir)
+    from rate_limiter import AdaptiveRateController
+
+    script, overrides = SCENARIOS[args.worker]
+    if script != '01_search.py':
+        bvids = [f"BV1fake{i:05d}" for i in range(args.videos)]
+        with open("video_index.csv", 'w', encoding='utf-8-sig') as f:
+            f.write("bvid,title,crawled\n" + "".join(f"{bvid},Synthetic video {bvid},0\n" for bvid in bvids))
+
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        module = load_stage(script)
+    point_at(module, args.base_url)
+    for name, value in overrides.items():
+        setattr(module, name, value)
+    module.rate_controller = AdaptiveRateController(
+        initial_rate=args.rate, min_rate=min(0.5, args.rate), max_rate=args.rate * 2,
+        burst=max(1, int(args.rate)), name=args.worker
+    )
+    if script == '01_search.py':
+        module.MAX_VIDEOS = args.videos
+    if hasattr(module, 'MIN_DELAY'):
+        module.MIN_DELAY = module.MAX_DELAY = 0
+
+    sys.argv = [script, '--batch'] if script == '04_get_subtitles.py' else [script]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(log):
+        module.main()
+    seconds = time.perf_counter() - start
+
+    if script == '01_search.py':
+        done = sum(1 for _ in open("video_index.csv", encoding='utf-8-sig')) - 1
+        failed = max(0, args.videos - done)
+    else:
+        from crawl_state import CrawlStateStore
+        stage = 'subtitle' if script == '04_get_subtitles.py' else 'danmaku'
+        statuses = CrawlStateStore().statuses(stage)
+        done = sum(1 for bvid in bvids if statuses.get(bvid) == 1)
+        failed = len(bvids) - done
+
+    print(json.dumps({
+        'videos': done,
+        'failed': failed,
+        'seconds': round(seconds, 3),
+        'videos_per_min': round(done / seconds * 60, 1) if seconds else None,
+        'peak_rss_mb': round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None,
+        'final_rate': round(module.rate_controller.rate, 3),
+    }))
+
+
+def run_scenario(name, server, args, throttle):
+    server.throttle_rate = throttle
+    server.reset_stats()
+    env = dict(os.environ, HTTP_CACHE_MODE='off')
+    with tempfile.TemporaryDirectory(prefix=f"bench_{name}_") as workdir:
+        command = [sys.executable, os.path.abspath(__file__), '--worker', name, '--workdir', workdir,
+                   '--base-url', server.base_url, '--videos', str(args.videos), '--rate', str(args.rate)]
+        completed = subprocess.run(command, env=env, capture_output=True, text=True, encoding='utf-8')
+    if completed.returncode != 0:
+        print(f"  [ERROR] {name}: {completed.stderr.strip().splitlines()[-1:]}")
+        return None
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result.update(scenario=name, throttle=throttle, requests=server.stats['requests'],
+                  throttled=server.stats['throttled'])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline crawler benchmark against fake_bilibili_server")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help="comma-separated, from: " + ', '.join(SCENARIOS))
+    parser.add_argument('--videos', type=int, default=40)
+    parser.add_argument('--rate', type=float, default=20.0, help="initial adaptive request rate (req/s)")
+    parser.add_argument('--latency', type=float, default=50, help="server latency per request (ms)")
+    parser.add_argument('--jitter', type=float, default=20, help="random extra latency, 0..jitter ms")
+    parser.add_argument('--throttle', default='0', help="comma-separated 412 rates to run every scenario at")
+    parser.add_argument('--pages', type=int, default=1, help="pages (P) per video")
+    parser.add_argument('--danmaku', type=int, default=3000, help="danmaku per page")
+    parser.add_argument('--subtitle-lines', type=int, default=300)
+    parser.add_argument('--recorded', help="http_cache directory to replay recorded responses from")
+    parser.add_argument('--output', help="write the results as JSON")
+    parser.add_argument('--worker', help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    parser.add_argument('--base-url', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    from fake_bilibili_server import FakeBilibiliServer
+
+    server = FakeBilibiliServer(
+        latency_ms=args.latency, jitter_ms=args.jitter, recorded_dir=args.recorded,
+        pages_per_video=args.pages, danmaku_per_page=args.danmaku, subtitle_lines=args.subtitle_lines,
+        search_results=max(args.videos, 30)
+    )
+    server.start()
+    print(f"[SERVER] {server.base_url} latency {args.latency}+{args.jitter}ms, "
+          f"{args.pages} page(s) x {args.danmaku} danmaku per video")
+
+    results = []
+    header = f"{'scenario':<18} {'412 rate':>8} {'videos':>7} {'failed':>7} {'sec':>8} {'videos/min':>11} " \
+             f"{'peak MB':>8} {'requests':>9} {'412s':>6} {'end rate':>9}"
+    print(header)
+    print("-" * len(header))
+    for throttle in [float(value) for value in args.throttle.split(',')]:
+        for name in args.scenarios.split(','):
+            result = run_scenario(name, server, args, throttle)
+            if result is None:
+                continue
+            results.append(result)
+            print(f"{name:<18} {throttle:>8.2f} {result['videos']:>7} {result['failed']:>7} {result['seconds']:>8.2f} "
+                  f"{result['videos_per_min']:>11,.1f} {result['peak_rss_mb'] or float('nan'):>8.1f} "
+                  f"{result['requests']:>9,} {result['throttled']:>6,} {result['final_rate']:>9.2f}")
+    server.stop()
+
+    incomplete = sorted({result['scenario'] for result in results if result['failed']})
+    if incomplete:
+        print(f"\n[WARN] Videos failed in: {', '.join(incomplete)}; their videos/min covers completed videos only")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n[SAVED] {args.output}")
+
+
+if __name__ == "__main__":
+    main()
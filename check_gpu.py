@@ -32,5 +32,15 @@ else:
     print("pip uninstall torch torchvision torchaudio")
     print("pip install torch torchvision torchaudio --index-url https://download.pytorch.org/whl/cu121")
 
+print("\nCPU 转录引擎（faster-whisper / CTranslate2）")
+try:
+    import ctranslate2
+    compute_types = ctranslate2.get_supported_compute_types("cpu")
+    print(f"CTranslate2版本: {ctranslate2.__version__}，CPU 支持: {', '.join(sorted(compute_types))}")
+    if "int8" in compute_types:
+        print("✓ 无 GPU 时可设置 ASR_BACKEND = \"faster-whisper\"（int8），CPU 转录速度为 PyTorch 的数倍")
+except ImportError:
+    print("✗ 未安装 faster-whisper：pip install faster-whisper")
+
 print("=" * 60)
 
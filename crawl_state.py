@@ -0,0 +1,152 @@
+"""
+Transactional crawl-state store (SQLite, WAL mode)
+Holds per-video, per-stage status so the crawlers no longer rewrite
+video_index.csv after every video. Each update is a single small
+transaction; several workers/processes may write at the same time.
+
+Stages and the video_index.csv columns they map to:
+    danmaku  (02, 03)  -> crawled
+    subtitle (04)      -> has_subtitle, subtitle_method, subtitle_count
+
+Regenerate video_index.csv from the store with:
+
+    python crawl_state.py --export video_index.csv
+"""
+
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+STATE_FILE = "crawl_state.sqlite"
+
+# stage -> (status column, method column, count column) in video_index.csv
+STAGE_COLUMNS = {
+    'danmaku': ('crawled', None, None),
+    'subtitle': ('has_subtitle', 'subtitle_method', 'subtitle_count'),
+}
+
+
+class CrawlStateStore:
+    """Per-(bvid, stage) status with retry counts and the last error"""
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS video_state ("
+            "bvid TEXT NOT NULL, stage TEXT NOT NULL, status INTEGER NOT NULL DEFAULT 0, "
+            "method TEXT, count INTEGER, retries INTEGER NOT NULL DEFAULT 0, last_error TEXT, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (bvid, stage))"
+        )
+        conn.commit()
+
+    def _conn(self):
+        """One connection per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+
+    def import_index(self, video_df, stage):
+        """Seed a stage from an existing video_index.csv (rows already in the store are kept)"""
+        status_col, method_col, count_col = STAGE_COLUMNS[stage]
+        now = time.time()
+        rows = []
+        for _, row in video_df.iterrows():
+            status = row.get(status_col, 0)
+            method = row.get(method_col) if method_col else None
+            count = row.get(count_col) if count_col else None
+            rows.append((
+                str(row['bvid']), stage,
+                int(status) if status == status else 0,
+                method if isinstance(method, str) else None,
+                int(count) if count is not None and count == count else None,
+                now
+            ))
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT OR IGNORE INTO video_state (bvid, stage, status, method, count, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def set_status(self, bvid, stage, status, method=None, count=None, error=None):
+        """Record a stage outcome; failures (status < 0) increment the retry counter"""
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO video_state (bvid, stage, status, method, count, retries, last_error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (bvid, stage) DO UPDATE SET "
+                "status = excluded.status, method = excluded.method, count = excluded.count, "
+                "retries = video_state.retries + excluded.retries, last_error = excluded.last_error, "
+                "updated_at = excluded.updated_at",
+                (bvid, stage, status, method, count, 1 if status < 0 else 0, error, time.time())
+            )
+
+    def statuses(self, stage):
+        """{bvid: status} for one stage"""
+        rows = self._conn().execute("SELECT bvid, status FROM video_state WHERE stage = ?", (stage,))
+        return dict(rows.fetchall())
+
+    def pending(self, bvids, stage):
+        """bvids whose stage is not done (status != 1), in input order"""
+        done = {bvid for bvid, status in self.statuses(stage).items() if status == 1}
+        return [bvid for bvid in bvids if bvid not in done]
+
+    def export_index(self, index_file, output_file=None, video_df=None):
+        """
+        Write index_file's rows with the stage columns filled from the store (atomic replace).
+        Pass video_df to export an already-loaded index instead of re-reading index_file.
+        """
+        import pandas as pd
+
+        output_file = output_file or index_file
+        if video_df is None:
+            video_df = pd.read_csv(index_file, encoding='utf-8-sig')
+        video_df = video_df.copy()
+        conn = self._conn()
+        for stage, (status_col, method_col, count_col) in STAGE_COLUMNS.items():
+            rows = conn.execute(
+                "SELECT bvid, status, method, count FROM video_state WHERE stage = ?", (stage,)
+            ).fetchall()
+            if not rows:
+                continue
+            state = {bvid: (status, method, count) for bvid, status, method, count in rows}
+            known = video_df['bvid'].astype(str).isin(state)
+            bvids = video_df.loc[known, 'bvid'].astype(str)
+            video_df.loc[known, status_col] = [state[b][0] for b in bvids]
+            video_df[status_col] = video_df[status_col].fillna(0).astype(int)
+            # Cast before assigning: pandas refuses strings in an all-empty (float) column
+            # and None in an int column; failed videos carry no count
+            if method_col:
+                video_df[method_col] = video_df.get(method_col, pd.Series(None, index=video_df.index)).astype('object')
+                video_df.loc[known, method_col] = [state[b][1] for b in bvids]
+            if count_col:
+                counts = video_df.get(count_col, pd.Series(None, index=video_df.index))
+                video_df[count_col] = pd.to_numeric(counts, errors='coerce').astype('Int64')
+                video_df.loc[known, count_col] = pd.array([state[b][2] for b in bvids], dtype='Int64')
+
+        tmp_file = output_file + ".tmp"
+        video_df.to_csv(tmp_file, encoding='utf-8-sig', index=False)
+        os.replace(tmp_file, output_file)
+        return video_df
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] != '--export':
+        print("Usage: python crawl_state.py --export video_index.csv [output.csv]")
+        return
+    output_file = sys.argv[3] if len(sys.argv) > 3 else None
+    video_df = CrawlStateStore().export_index(sys.argv[2], output_file)
+    print(f"[SAVED] {output_file or sys.argv[2]} ({len(video_df)} videos)")
+
+
+if __name__ == "__main__":
+    main()
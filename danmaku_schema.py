@@ -0,0 +1,184 @@
+"""
+弹幕数据的统一紧凑类型（爬虫 02/03、07、08 共用）
+
+- 时间为 float32，mode / pool / font_size 为 uint8，color 为 uint32
+- bvid、user_hash、mode_name、cid 等重复字符串为 categorical（Parquet 中为字典编码）
+- source 记录该行弹幕来自哪个爬虫（web = 02，api = 03，legacy = 旧版 CSV）
+- 视频标题不再逐行重复，统一放在视频表 video_index.csv（bvid, title）中，需要时按 bvid 连接
+
+旧格式的 CSV（字符串类型、带 video_title 列）也可以直接用本模块的加载函数读取
+"""
+
+import os
+from typing import Optional
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+
+VIDEO_INDEX_FILE = "video_index.csv"
+
+# 高级弹幕 / BAS 弹幕
+HIDDEN_MODES = (8, 9)
+
+# color 列：普通颜色为 24 位 RGB；渐变等特殊颜色（bilibili-api 中为 "special"）记为此值
+SPECIAL_COLOR = 0xFFFFFFFF
+
+# 弹幕行（爬虫输出）的列类型
+DANMAKU_DTYPES = {
+    'bvid': 'category',
+    'video_time_sec': 'float32',
+    'mode': 'uint8',
+    'mode_name': 'category',
+    'font_size': 'uint8',
+    'color': 'uint32',
+    'timestamp': 'uint32',
+    'pool': 'uint8',
+    'user_hash': 'category',
+    'dmid': 'str',
+    'text': 'str',
+    'page': 'uint16',
+    'cid': 'category',
+    'page_offset_sec': 'float32',
+    'source': 'category',
+}
+# 整数列缺失值的默认值（其余为 0）：旧版 CSV 与早期 03 输出没有 page，均为 P1
+INTEGER_DEFAULTS = {'page': 1}
+NUMERIC_COLUMNS = [col for col, dtype in DANMAKU_DTYPES.items() if dtype not in ('category', 'str')]
+# 不再逐行保存的列（移至视频表）
+VIDEO_LEVEL_COLUMNS = ['video_title']
+
+_dict_string = pa.dictionary(pa.int32(), pa.string())
+
+# Parquet 分区文件的列布局（bvid 由分区路径提供，不写入文件）
+DANMAKU_ARROW_SCHEMA = pa.schema([
+    ('video_time_sec', pa.float32()),
+    ('mode', pa.uint8()),
+    ('mode_name', _dict_string),
+    ('font_size', pa.uint8()),
+    ('color', pa.uint32()),
+    ('timestamp', pa.uint32()),
+    ('pool', pa.uint8()),
+    ('user_hash', _dict_string),
+    ('dmid', pa.string()),
+    ('text', pa.string()),
+    ('page', pa.uint16()),
+    ('cid', _dict_string),
+    ('page_offset_sec', pa.float32()),
+    ('source', _dict_string),
+])
+
+# 07 输出的匹配结果中弹幕列带 danmaku_ 前缀；时间列保留 float64，08 需用其做窗口计算并写出事件时间
+MATCHED_DTYPES = {
+    'danmaku_time': 'float64',
+    'danmaku_content': 'str',
+    'subtitle_content': 'category',
+    'subtitle_from': 'float64',
+    'subtitle_to': 'float64',
+    **{f'danmaku_{col}': dtype for col, dtype in DANMAKU_DTYPES.items()
+       if col not in ('video_time_sec', 'text')},
+}
+
+
+def apply_schema(df: pd.DataFrame, dtypes=DANMAKU_DTYPES) -> pd.DataFrame:
+    """
+    按 dtypes 转换已有的列（整数列中无法解析或超出类型范围的值，如负的 pool，
+    记为 INTEGER_DEFAULTS 中的默认值或 0，而不是回绕），并去掉视频级的列
+    """
+    df = df.drop(columns=[col for col in df.columns if col.split('danmaku_')[-1] in VIDEO_LEVEL_COLUMNS])
+    for col, dtype in dtypes.items():
+        if col not in df.columns:
+            continue
+        if dtype in ('category', 'str'):
+            values = df[col].where(df[col].isna(), df[col].astype(str))
+            df[col] = values.astype(dtype) if dtype == 'category' else values
+        elif np.issubdtype(np.dtype(dtype), np.integer):
+            default = INTEGER_DEFAULTS.get(col.split('danmaku_')[-1], 0)
+            limits = np.iinfo(dtype)
+            values = pd.to_numeric(df[col], errors='coerce')
+            values = values.where(values.between(limits.min, limits.max))
+            df[col] = values.fillna(default).astype(dtype)
+        else:
+            df[col] = pd.to_numeric(df[col], errors='coerce').astype(dtype)
+    return df
+
+
+def hex_color(value) -> int:
+    """
+    bilibili-api 的颜色（十六进制字符串，如 "ffffff"，或 "special"）转换为整数
+    """
+    if isinstance(value, int):
+        return value
+    try:
+        return int(str(value), 16)
+    except ValueError:
+        return SPECIAL_COLOR
+
+
+def danmaku_frame(rows) -> pd.DataFrame:
+    """
+    爬虫产出的弹幕行（dict 列表）转换为紧凑类型的 DataFrame
+    """
+    return apply_schema(pd.DataFrame(rows))
+
+
+def concat_danmaku(frames) -> pd.DataFrame:
+    """
+    拼接多个紧凑弹幕表；categorical 列合并类别，不会退化为 object
+    """
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame()
+    if len(frames) == 1:
+        return frames[0].reset_index(drop=True)
+    columns = {}
+    for col in frames[0].columns:
+        parts = [frame[col] for frame in frames]
+        if all(isinstance(part.dtype, pd.CategoricalDtype) for part in parts):
+            columns[col] = union_categoricals(parts, ignore_order=True)
+        else:
+            columns[col] = pd.concat(parts, ignore_index=True)
+    return pd.DataFrame(columns)
+
+
+def _read_csv(path: str, dtypes) -> pd.DataFrame:
+    string_columns = {col: str for col, dtype in dtypes.items() if dtype in ('category', 'str')}
+    df = pd.read_csv(path, dtype=string_columns, keep_default_na=False, na_values=[''],
+                     usecols=lambda col: col.split('danmaku_')[-1] not in VIDEO_LEVEL_COLUMNS)
+    return apply_schema(df, dtypes)
+
+
+def load_danmaku_csv(path: str) -> pd.DataFrame:
+    """
+    读取单个视频的弹幕 CSV 并应用统一类型
+    """
+    return _read_csv(path, DANMAKU_DTYPES)
+
+
+def load_danmaku_parquet(path: str, bvid: Optional[str] = None) -> pd.DataFrame:
+    """
+    读取单个视频的 Parquet 分区（见 danmaku_store）；bvid 位于分区路径 bvid=... 中，补回为列
+    """
+    df = pd.read_parquet(path)
+    if bvid is None:
+        partition = os.path.basename(os.path.dirname(path))
+        bvid = partition[len('bvid='):] if partition.startswith('bvid=') else None
+    if bvid is not None and 'bvid' not in df.columns:
+        df.insert(0, 'bvid', bvid)
+    return apply_schema(df)
+
+
+def load_matched_csv(path: str) -> pd.DataFrame:
+    """
+    读取 07 输出的弹幕-字幕匹配结果并应用统一类型
+    """
+    return _read_csv(path, MATCHED_DTYPES)
+
+
+def load_video_table(index_file: str = VIDEO_INDEX_FILE) -> pd.DataFrame:
+    """
+    视频表：每个视频一行（bvid 与标题等视频级字段），弹幕表按 bvid 与之连接
+    """
+    video_df = pd.read_csv(index_file, encoding='utf-8-sig')
+    video_df['bvid'] = video_df['bvid'].astype('category')
+    return video_df
@@ -0,0 +1,209 @@
+"""
+Parquet storage for crawled danmaku (02, 03)
+Each crawler streams finished videos into its own source dataset, so reruns
+through 02 and 03 never overwrite each other; compaction then unions all
+sources per video, drops duplicate dmids and writes one canonical partition
+that downstream stages (07) read:
+
+    danmaku_results/
+    ├── sources/
+    │   ├── web.parquet/bvid=BV.../part-0.parquet    # 02 (raw web endpoints)
+    │   ├── api.parquet/bvid=BV.../part-0.parquet    # 03 (bilibili-api)
+    │   └── web/, api/                               # per-video CSV exports
+    └── all_danmaku.parquet/bvid=BV.../part-0.parquet  # canonical, deduplicated
+
+Legacy per-video CSVs directly in danmaku_results/ are picked up by
+compaction as source "legacy". Columns use the compact types from
+danmaku_schema; `source` records where each kept row came from. The merged
+and hidden-danmaku views are lazy scans over the canonical dataset.
+
+    python danmaku_store.py --compact danmaku_results
+    python danmaku_store.py --csv danmaku_results/all_danmaku.parquet
+"""
+
+import glob
+import os
+import re
+import sys
+from collections import Counter
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from danmaku_schema import DANMAKU_ARROW_SCHEMA, HIDDEN_MODES, load_danmaku_csv
+
+DATASET_NAME = "all_danmaku.parquet"
+SOURCES_DIR = "sources"
+PART_FILE = "part-0.parquet"
+
+# On a duplicate dmid the row from the earlier source is kept
+SOURCE_PRIORITY = ['web', 'api', 'legacy']
+
+# Legacy per-video CSVs are named <bvid>_<title>.csv; aggregate exports written to the
+# same directory (all_danmaku_merged.csv, hidden_danmaku_only.csv) must not match
+LEGACY_CSV_PATTERN = re.compile(r'^BV[0-9A-Za-z]{10}_')
+
+PARTITIONING = ds.partitioning(pa.schema([('bvid', pa.string())]), flavor='hive')
+
+
+def frame_to_table(frame):
+    """Build a table with DANMAKU_ARROW_SCHEMA from a typed danmaku frame (missing columns become null)"""
+    arrays = [
+        pa.Array.from_pandas(frame[field.name]).cast(field.type) if field.name in frame.columns
+        else pa.nulls(len(frame), field.type)
+        for field in DANMAKU_ARROW_SCHEMA
+    ]
+    return pa.Table.from_arrays(arrays, schema=DANMAKU_ARROW_SCHEMA)
+
+
+def source_dataset_path(output_dir, source):
+    return os.path.join(output_dir, SOURCES_DIR, f"{source}.parquet")
+
+
+def partition_file(dataset_path, bvid):
+    return os.path.join(dataset_path, f"bvid={bvid}", PART_FILE)
+
+
+def write_partition(dataset_path, bvid, table):
+    """Replace the partition of `bvid` with `table` (atomic per video)"""
+    target = partition_file(dataset_path, bvid)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    # Files starting with '_' are ignored by dataset discovery until renamed
+    tmp_file = os.path.join(os.path.dirname(target), "_" + PART_FILE + ".tmp")
+    pq.write_table(table, tmp_file, compression='zstd')
+    os.replace(tmp_file, target)
+
+
+class DanmakuParquetWriter:
+    """Write one partition per video into a crawler's source dataset and keep running statistics"""
+
+    def __init__(self, output_dir, source):
+        self.source = source
+        self.path = source_dataset_path(output_dir, source)
+        self.csv_dir = os.path.join(output_dir, SOURCES_DIR, source)
+        os.makedirs(self.path, exist_ok=True)
+        os.makedirs(self.csv_dir, exist_ok=True)
+        self.total = 0
+        self.hidden = 0
+        self.mode_counts = Counter()
+
+    def write_video(self, bvid, frame):
+        """Store `frame` (see danmaku_schema.danmaku_frame) as this source's copy of `bvid`"""
+        if frame.empty:
+            return
+        frame = frame.assign(source=self.source)
+        write_partition(self.path, bvid, frame_to_table(frame))
+
+        self.total += len(frame)
+        self.hidden += int(frame['mode'].isin(HIDDEN_MODES).sum())
+        self.mode_counts.update(frame['mode_name'].value_counts().to_dict())
+
+
+def _source_names(output_dir):
+    """Source datasets present on disk, in SOURCE_PRIORITY order (unknown sources last)"""
+    paths = glob.glob(os.path.join(output_dir, SOURCES_DIR, "*.parquet"))
+    names = [os.path.basename(path)[:-len(".parquet")] for path in paths]
+    rank = {name: i for i, name in enumerate(SOURCE_PRIORITY)}
+    return sorted(names, key=lambda name: (rank.get(name, len(rank)), name))
+
+
+def _legacy_csv_files(output_dir, bvid='*'):
+    paths = glob.glob(os.path.join(output_dir, f"{bvid}_*.csv"))
+    return sorted(path for path in paths if LEGACY_CSV_PATTERN.match(os.path.basename(path)))
+
+
+def compact_video(output_dir, bvid):
+    """
+    Union every source's copy of one video, keep the first row per dmid (by source priority)
+    and write the canonical partition. Returns (rows read, rows kept).
+    """
+    tables = []
+    for source in _source_names(output_dir):
+        part = partition_file(source_dataset_path(output_dir, source), bvid)
+        if os.path.exists(part):
+            tables.append(pq.read_table(part, schema=DANMAKU_ARROW_SCHEMA))
+    for csv_file in _legacy_csv_files(output_dir, bvid):
+        tables.append(frame_to_table(load_danmaku_csv(csv_file).assign(source='legacy')))
+    if not tables:
+        return 0, 0
+
+    merged = pa.concat_tables(tables).unify_dictionaries().combine_chunks()
+    # Legacy CSVs and pre-multi-page api rows carry no page: they are P1
+    page_index = merged.schema.get_field_index('page')
+    merged = merged.set_column(page_index, 'page', pc.fill_null(merged.column('page'), pa.scalar(1, pa.uint16())))
+    dmid = merged.column('dmid').to_pandas()
+    keyed = dmid.notna() & (dmid != '')
+    # Vectorized key check: rows are in priority order, so duplicated() keeps the preferred copy
+    keep = ~(keyed & dmid.duplicated()).to_numpy()
+    compacted = merged.filter(pa.array(keep))
+    compacted = compacted.take(pc.sort_indices(compacted, [('video_time_sec', 'ascending')]))
+
+    write_partition(os.path.join(output_dir, DATASET_NAME), bvid, compacted)
+    return merged.num_rows, compacted.num_rows
+
+
+def compact(output_dir, bvids=None):
+    """Compact the given videos (default: every video found in any source)"""
+    if bvids is None:
+        bvids = set()
+        for source in _source_names(output_dir):
+            bvids.update(os.path.basename(path)[len("bvid="):]
+                         for path in glob.glob(os.path.join(source_dataset_path(output_dir, source), "bvid=*")))
+        bvids.update(os.path.basename(path).split('_')[0] for path in _legacy_csv_files(output_dir))
+    rows_read = rows_kept = 0
+    for bvid in sorted(bvids):
+        read, kept = compact_video(output_dir, bvid)
+        rows_read += read
+        rows_kept += kept
+    print(f"[COMPACT] {len(bvids)} videos: {rows_read:,} rows in, {rows_kept:,} unique kept "
+          f"-> {os.path.join(output_dir, DATASET_NAME)}")
+    return rows_read, rows_kept
+
+
+def canonical_video_files(output_dir):
+    """[(bvid, partition file)] of the canonical dataset"""
+    paths = sorted(glob.glob(os.path.join(output_dir, DATASET_NAME, "bvid=*", PART_FILE)))
+    return [(os.path.basename(os.path.dirname(path))[len("bvid="):], path) for path in paths]
+
+
+def merged_view(dataset_path):
+    """Lazy dataset over every crawled video (bvid comes from the partition path)"""
+    schema = pa.schema([pa.field('bvid', pa.string())] + list(DANMAKU_ARROW_SCHEMA))
+    return ds.dataset(dataset_path, format='parquet', schema=schema, partitioning=PARTITIONING)
+
+
+def hidden_view(dataset_path):
+    """Lazy scanner over advanced/BAS (mode 8/9) danmaku only"""
+    return merged_view(dataset_path).scanner(filter=ds.field('mode').isin(list(HIDDEN_MODES)))
+
+
+def export_csv(dataset_path, output_dir):
+    """Materialize the merged and hidden views as the legacy CSV files, batch by batch"""
+    outputs = [
+        (merged_view(dataset_path).scanner(), os.path.join(output_dir, "all_danmaku_merged.csv")),
+        (hidden_view(dataset_path), os.path.join(output_dir, "hidden_danmaku_only.csv")),
+    ]
+    for scanner, csv_file in outputs:
+        rows = 0
+        with open(csv_file, 'w', encoding='utf-8-sig', newline='') as f:
+            for batch in scanner.to_batches():
+                if batch.num_rows:
+                    batch.to_pandas().to_csv(f, header=rows == 0, index=False)
+                    rows += batch.num_rows
+        print(f"[SAVED] {csv_file} ({rows:,} rows)")
+
+
+def main():
+    if len(sys.argv) >= 3 and sys.argv[1] == '--compact':
+        compact(sys.argv[2])
+    elif len(sys.argv) >= 3 and sys.argv[1] == '--csv':
+        dataset_path = sys.argv[2]
+        output_dir = sys.argv[3] if len(sys.argv) > 3 else os.path.dirname(os.path.abspath(dataset_path))
+        export_csv(dataset_path, output_dir)
+    else:
+        print("Usage: python danmaku_store.py --compact danmaku_results")
+        print(f"       python danmaku_store.py --csv danmaku_results/{DATASET_NAME} [output_dir]")
+
+
+if __name__ == "__main__":
+    main()
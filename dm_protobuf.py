@@ -0,0 +1,112 @@
+"""
+Decoder for Bilibili's protobuf danmaku segments (x/v2/dm/web/seg.so)
+Bundled schema (subset of bilibili.community.service.dm.v1):
+
+    message DmSegMobileReply {
+        repeated DanmakuElem elems = 1;
+    }
+    message DanmakuElem {
+        int64  id        = 1;
+        int32  progress  = 2;   // ms from video start
+        int32  mode      = 3;
+        int32  fontsize  = 4;
+        uint32 color     = 5;
+        string midHash   = 6;
+        string content   = 7;
+        int64  ctime     = 8;
+        int32  weight    = 9;
+        string action    = 10;
+        int32  pool      = 11;
+        string idStr     = 12;
+        int32  attr      = 13;
+    }
+
+Only the wire format is needed, so no protobuf runtime dependency.
+"""
+
+# field number -> (name, type); unknown fields are skipped
+DANMAKU_ELEM_FIELDS = {
+    1: ('id', 'int'),
+    2: ('progress', 'int'),
+    3: ('mode', 'int'),
+    4: ('fontsize', 'int'),
+    5: ('color', 'int'),
+    6: ('midHash', 'str'),
+    7: ('content', 'str'),
+    8: ('ctime', 'int'),
+    9: ('weight', 'int'),
+    10: ('action', 'str'),
+    11: ('pool', 'int'),
+    12: ('idStr', 'str'),
+    13: ('attr', 'int'),
+}
+DM_SEG_ELEMS_FIELD = 1
+
+SEGMENT_SECONDS = 360    # each seg.so segment covers 6 minutes
+
+
+def _read_varint(buf, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
+
+
+def _iter_fields(buf):
+    """Yield (field_number, wire_type, value) for one message"""
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = _read_varint(buf, pos)
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == 0:
+            value, pos = _read_varint(buf, pos)
+        elif wire_type == 2:
+            length, pos = _read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == 1:
+            value = buf[pos:pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos:pos + 4]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type} at offset {pos}")
+        yield field, wire_type, value
+
+
+def decode_danmaku_elem(buf):
+    """Decode one DanmakuElem into a dict keyed by the schema field names"""
+    elem = {}
+    for field, wire_type, value in _iter_fields(buf):
+        spec = DANMAKU_ELEM_FIELDS.get(field)
+        if spec is None:
+            continue
+        name, kind = spec
+        if kind == 'str' and wire_type == 2:
+            elem[name] = bytes(value).decode('utf-8', errors='replace')
+        elif kind == 'int' and wire_type == 0:
+            # int32/int64 negatives are encoded as 64-bit two's complement
+            elem[name] = value - (1 << 64) if value >= (1 << 63) else value
+    return elem
+
+
+def decode_segment(content):
+    """Decode a DmSegMobileReply body into a list of DanmakuElem dicts"""
+    buf = memoryview(content)
+    return [
+        decode_danmaku_elem(value)
+        for field, wire_type, value in _iter_fields(buf)
+        if field == DM_SEG_ELEMS_FIELD and wire_type == 2
+    ]
+
+
+def segment_count(duration_sec):
+    """Number of 6-minute segments needed to cover a video"""
+    return max(1, -(-int(duration_sec) // SEGMENT_SECONDS))
@@ -0,0 +1,373 @@
+"""
+Local stand-in for the Bilibili endpoints used by the crawlers (01, 02, 04)
+Serves synthetic but well-formed responses, or replays responses recorded in
+an http_cache directory, with configurable latency, 412 injection and
+payload sizes. Used by benchmark_crawlers.py; can also be run on its own:
+
+    python fake_bilibili_server.py --port 8800 --latency 50 --throttle 0.05
+
+Endpoints (paths as on api.bilibili.com; subtitle bodies under /bfs/subtitle/):
+    /x/web-interface/nav                   login state + WBI keys
+    /x/web-interface/wbi/search/type       search result pages
+    /x/web-interface/view                  video metadata (pages, cid, pubdate)
+    /video/{bvid}                          HTML video page
+    /x/player/v2                           subtitle track list
+    /bfs/subtitle/{cid}_{lan}.json         subtitle body
+    /x/v1/dm/list.so                       XML danmaku pool
+    /x/v2/dm/web/seg.so                    protobuf danmaku segment
+    /x/v2/dm/history/index                 dates with history snapshots
+    /x/v2/dm/web/history/seg.so            protobuf history snapshot
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+import zlib
+from collections import Counter
+from datetime import date, timedelta
+from aiohttp import web
+from dm_protobuf import SEGMENT_SECONDS, segment_count
+
+API_HOST = "https://api.bilibili.com"
+SUBTITLE_HOST = "https://aisubtitle.hdslb.com"
+
+# Status and body of an injected anti-crawler response
+THROTTLE_STATUS = 412
+THROTTLE_BODY = {'code': -412, 'message': '请求被拦截'}
+
+MODES = [1] * 90 + [4] * 4 + [5] * 4 + [8, 9]
+
+
+# ==================== Protobuf encoding ====================
+def _varint(value):
+    value &= (1 << 64) - 1
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field(number, value):
+    """One protobuf field: int -> varint, str/bytes -> length-delimited"""
+    if isinstance(value, int):
+        return _varint(number << 3) + _varint(value)
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return _varint(number << 3 | 2) + _varint(len(value)) + value
+
+
+def encode_segment(elems):
+    """DmSegMobileReply body for a list of DanmakuElem dicts (see dm_protobuf)"""
+    out = bytearray()
+    for elem in elems:
+        body = b''.join([
+            _field(1, elem['id']), _field(2, elem['progress']), _field(3, elem['mode']),
+            _field(4, elem['fontsize']), _field(5, elem['color']), _field(6, elem['midHash']),
+            _field(7, elem['content']), _field(8, elem['ctime']), _field(11, elem['pool']),
+            _field(12, str(elem['id'])),
+        ])
+        out += _field(1, body)
+    return bytes(out)
+
+
+# ==================== Synthetic data ====================
+def _seed(*parts):
+    return zlib.crc32('|'.join(str(part) for part in parts).encode())
+
+
+class SyntheticData:
+    """Deterministic videos, danmaku and subtitles derived from bvid / cid"""
+
+    def __init__(self, pages_per_video=1, duration_sec=900, danmaku_per_page=3000, subtitle_lines=300,
+                 subtitle_languages=('zh-CN', 'ai-zh'), history_days_per_month=3, search_results=300):
+        self.pages_per_video = pages_per_video
+        self.duration_sec = duration_sec
+        self.danmaku_per_page = danmaku_per_page
+        self.subtitle_lines = subtitle_lines
+        self.subtitle_languages = list(subtitle_languages)
+        self.history_days_per_month = history_days_per_month
+        self.search_results = search_results
+
+    def bvid(self, index):
+        return f"BV1fake{index:05d}"
+
+    def cid(self, bvid, page):
+        return _seed(bvid) % 10**8 * 100 + page
+
+    def view(self, bvid):
+        pages = [{'cid': self.cid(bvid, page), 'page': page, 'part': f"P{page}", 'duration': self.duration_sec}
+                 for page in range(1, self.pages_per_video + 1)]
+        pubdate = int(time.time()) - 60 * 24 * 3600
+        return {'bvid': bvid, 'cid': pages[0]['cid'], 'title': f"Synthetic video {bvid}",
+                'duration': self.duration_sec * len(pages), 'pubdate': pubdate, 'pages': pages}
+
+    def search_page(self, page, page_size):
+        start = (page - 1) * page_size
+        items = []
+        for index in range(start, min(start + page_size, self.search_results)):
+            bvid = self.bvid(index)
+            items.append({
+                'bvid': bvid, 'title': f'Synthetic <em class="keyword">video</em> {index}',
+                'author': f"up{index % 50}", 'play': 10000 + _seed(bvid) % 1000000,
+                'video_review': self.danmaku_per_page * self.pages_per_video,
+                'duration': f"{self.duration_sec // 60}:{self.duration_sec % 60:02d}",
+                'pubdate': int(time.time()) - index * 3600,
+            })
+        return items
+
+    def danmaku(self, cid):
+        """All danmaku of one page as DanmakuElem dicts, ordered by id"""
+        rng = random.Random(_seed('dm', cid))
+        now = int(time.time())
+        return [{
+            'id': cid * 100000 + i,
+            'progress': rng.randrange(self.duration_sec * 1000),
+            'mode': rng.choice(MODES),
+            'fontsize': 25,
+            'color': rng.choice((16777215, 16711680, 65280)),
+            'midHash': f"{rng.getrandbits(32):08x}",
+            'content': "？？？" if i % 17 == 0 else f"弹幕{i}",
+            'ctime': now - rng.randrange(60 * 24 * 3600),
+            'pool': 0,
+        } for i in range(self.danmaku_per_page)]
+
+    def xml(self, cid):
+        lines = ['<?xml version="1.0" encoding="UTF-8"?><i><chatserver>chat.bilibili.com</chatserver>'
+                 f'<chatid>{cid}</chatid>']
+        for elem in self.danmaku(cid):
+            lines.append(
+                f'<d p="{elem["progress"] / 1000:.5f},{elem["mode"]},{elem["fontsize"]},{elem["color"]},'
+                f'{elem["ctime"]},{elem["pool"]},{elem["midHash"]},{elem["id"]},10">{elem["content"]}</d>'
+            )
+        lines.append('</i>')
+        return '\n'.join(lines).encode('utf-8')
+
+    def segment(self, cid, segment):
+        start, end = (segment - 1) * SEGMENT_SECONDS * 1000, segment * SEGMENT_SECONDS * 1000
+        if segment > segment_count(self.duration_sec):
+            return b''
+        return encode_segment([elem for elem in self.danmaku(cid) if start <= elem['progress'] < end])
+
+    def history_dates(self, cid, month):
+        year, mon = (int(part) for part in month.split('-'))
+        first = date(year, mon, 1)
+        days = [(first + timedelta(days=offset)) for offset in range(28)]
+        rng = random.Random(_seed('days', cid, month))
+        chosen = sorted(rng.sample(days, min(self.history_days_per_month, len(days))))
+        return [day.isoformat() for day in chosen if day <= date.today()]
+
+    def history_segment(self, cid, day):
+        """A snapshot overlaps heavily with the current pool, so merging has duplicates to drop"""
+        elems = self.danmaku(cid)
+        rng = random.Random(_seed('snapshot', cid, day))
+        return encode_segment(rng.sample(elems, len(elems) // 2))
+
+    def player(self, bvid, cid, base_url):
+        return {'subtitle': {'subtitles': [
+            {'id': i, 'lan': lan, 'lan_doc': lan, 'subtitle_url': f"{base_url}/bfs/subtitle/{cid}_{lan}.json"}
+            for i, lan in enumerate(self.subtitle_languages)
+        ]}}
+
+    def subtitle(self, cid, lan):
+        step = self.duration_sec / max(self.subtitle_lines, 1)
+        return {'body': [{'from': round(i * step, 2), 'to': round((i + 1) * step, 2), 'location': 2,
+                          'content': f"[{lan}] line {i}"} for i in range(self.subtitle_lines)]}
+
+
+# ==================== Server ====================
+class FakeBilibiliServer:
+    """
+    aiohttp app serving SyntheticData (or an http_cache recording) with injected
+    latency and 412s. Attributes may be changed between benchmark runs.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency_ms=0, jitter_ms=0, throttle_rate=0.0,
+                 recorded_dir=None, seed=0, **synthetic):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.data = SyntheticData(**synthetic)
+        self.recorded = None
+        if recorded_dir:
+            from http_cache import HttpCache
+            self.recorded = HttpCache(recorded_dir, mode='replay')
+        self.rng = random.Random(seed)
+        self.stats = Counter()
+        self._runner = None
+        self._loop = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def reset_stats(self):
+        self.stats = Counter()
+
+    def app(self):
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_get('/x/web-interface/nav', self.nav)
+        app.router.add_get('/x/web-interface/wbi/search/type', self.search)
+        app.router.add_get('/x/web-interface/search/type', self.search)
+        app.router.add_get('/x/web-interface/view', self.view)
+        app.router.add_get('/video/{bvid}', self.video_page)
+        app.router.add_get('/x/player/v2', self.player)
+        app.router.add_get('/x/player/wbi/v2', self.player)
+        app.router.add_get('/bfs/subtitle/{name}', self.subtitle)
+        app.router.add_get('/x/v1/dm/list.so', self.xml)
+        app.router.add_get('/x/v2/dm/web/seg.so', self.segment)
+        app.router.add_get('/x/v2/dm/history/index', self.history_index)
+        app.router.add_get('/x/v2/dm/web/history/seg.so', self.history_segment)
+        return app
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        endpoint = 'subtitle' if request.path.startswith('/bfs/') else request.path.rsplit('/', 1)[-1]
+        self.stats['requests'] += 1
+        self.stats[f"requests:{endpoint}"] += 1
+        if self.latency_ms or self.jitter_ms:
+            await asyncio.sleep((self.latency_ms + self.rng.uniform(0, self.jitter_ms)) / 1000)
+        # CDN files are never throttled, API endpoints are
+        if not request.path.startswith('/bfs/') and self.rng.random() < self.throttle_rate:
+            self.stats['throttled'] += 1
+            return web.json_response(THROTTLE_BODY, status=THROTTLE_STATUS)
+        if self.recorded is not None:
+            response = self._replay(request)
+            if response is not None:
+                self.stats['replayed'] += 1
+                return response
+        response = await handler(request)
+        self.stats['bytes'] += response.content_length or 0
+        return response
+
+    def _replay(self, request):
+        """Recorded response for this request, with subtitle URLs pointed at this server"""
+        from http_cache import CacheMiss
+        host = SUBTITLE_HOST if request.path.startswith('/bfs/') else API_HOST
+        try:
+            cached = self.recorded.get(host + request.path_qs)
+        except CacheMiss:
+            return None
+        body = cached.content
+        if request.path.startswith('/x/player/'):
+            for origin in (b'https://aisubtitle.hdslb.com', b'//aisubtitle.hdslb.com'):
+                body = body.replace(origin, self.base_url.encode())
+        return web.Response(body=body, status=cached.status_code)
+
+    @staticmethod
+    def _ok(data):
+        return web.json_response({'code': 0, 'message': '0', 'data': data})
+
+    async def nav(self, request):
+        return self._ok({'isLogin': True, 'uname': 'benchmark', 'mid': 1, 'wbi_img': {
+            'img_url': 'https://i0.hdslb.com/bfs/wbi/7cd084941338484aae1ad9425b84077c.png',
+            'sub_url': 'https://i0.hdslb.com/bfs/wbi/4932caff0ff746eab6f01bf08b70ac45.png'}})
+
+    async def search(self, request):
+        page = int(request.query.get('page', 1))
+        page_size = int(request.query.get('page_size', 20))
+        return self._ok({'page': page, 'numResults': self.data.search_results,
+                         'result': self.data.search_page(page, page_size)})
+
+    async def view(self, request):
+        return self._ok(self.data.view(request.query['bvid']))
+
+    async def video_page(self, request):
+        state = json.dumps({'videoData': self.data.view(request.match_info['bvid'])}, ensure_ascii=False)
+        html = f"<html><head></head><body><script>window.__INITIAL_STATE__={state};</script></body></html>"
+        return web.Response(text=html, content_type='text/html')
+
+    async def player(self, request):
+        return self._ok(self.data.player(request.query.get('bvid'), request.query['cid'], self.base_url))
+
+    async def subtitle(self, request):
+        cid, lan = request.match_info['name'][:-len('.json')].split('_', 1)
+        return web.json_response(self.data.subtitle(int(cid), lan))
+
+    async def xml(self, request):
+        return web.Response(body=self.data.xml(int(request.query['oid'])), content_type='text/xml')
+
+    async def segment(self, request):
+        body = self.data.segment(int(request.query['oid']), int(request.query['segment_index']))
+        return web.Response(body=body, content_type='application/octet-stream')
+
+    async def history_index(self, request):
+        return self._ok(self.data.history_dates(int(request.query['oid']), request.query['month']))
+
+    async def history_segment(self, request):
+        body = self.data.history_segment(int(request.query['oid']), request.query['date'])
+        return web.Response(body=body, content_type='application/octet-stream')
+
+    async def start_async(self):
+        self._runner = web.AppRunner(self.app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self.port = self._runner.addresses[0][1]
+
+    def start(self):
+        """Serve from a background thread; returns the base URL"""
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self.start_async())
+            ready.set()
+            self._loop.run_forever()
+
+        self._thread = threading.Thread(target=run, name="fake-bilibili", daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in Bilibili API server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8800)
+    parser.add_argument('--latency', type=float, default=0, help="added latency per request (ms)")
+    parser.add_argument('--jitter', type=float, default=0, help="random extra latency, 0..jitter ms")
+    parser.add_argument('--throttle', type=float, default=0.0, help="fraction of API requests answered with 412")
+    parser.add_argument('--pages', type=int, default=1, help="pages (P) per video")
+    parser.add_argument('--danmaku', type=int, default=3000, help="danmaku per page")
+    parser.add_argument('--subtitle-lines', type=int, default=300)
+    parser.add_argument('--recorded', help="http_cache directory to replay recorded responses from")
+    args = parser.parse_args()
+
+    server = FakeBilibiliServer(
+        host=args.host, port=args.port, latency_ms=args.latency, jitter_ms=args.jitter,
+        throttle_rate=args.throttle, recorded_dir=args.recorded, pages_per_video=args.pages,
+        danmaku_per_page=args.danmaku, subtitle_lines=args.subtitle_lines
+    )
+
+    async def serve():
+        await server.start_async()
+        print(f"[SERVING] {server.base_url} (Ctrl+C to stop)")
+        while True:
+            await asyncio.sleep(3600)
+
+    try:
+        asyncio.run(serve())
+    except KeyboardInterrupt:
+        print(f"\n[STATS] {dict(server.stats)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+Content-addressed HTTP response cache shared by the crawler stages (01, 02, 04, video_meta)
+Responses are keyed by the normalized request (scheme/host/path plus sorted
+query parameters, without per-request signatures such as wts/w_rid/auth_key);
+bodies are stored once per content hash, zstd-compressed:
+
+    http_cache/
+    ├── index.sqlite                  # request key -> status, content hash, stored_at
+    └── objects/ab/abcdef....zst      # body, named by the sha256 of its content
+
+Each endpoint class has its own TTL (see ENDPOINT_TTLS and response_ttl). Only
+successful responses are stored (HTTP 200, and for JSON APIs `code == 0`).
+
+Set HTTP_CACHE_MODE to choose the behaviour for all stages at once:
+    readwrite  serve fresh cached responses, fetch and store the rest (default)
+    record     always fetch and store (refreshes the recorded fixture set)
+    replay     offline: serve cached responses regardless of age; a miss raises CacheMiss
+    off        bypass the cache
+
+    python http_cache.py --stats
+    python http_cache.py --purge-expired
+"""
+
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import requests
+import zstandard
+from rate_limiter import controlled_get
+
+CACHE_DIR = os.environ.get("HTTP_CACHE_DIR", "http_cache")
+CACHE_MODE = os.environ.get("HTTP_CACHE_MODE", "readwrite")
+MODES = ('readwrite', 'record', 'replay', 'off')
+
+DAY = 24 * 3600
+
+# (endpoint class, pattern on host + path, TTL in seconds; None = never expires), first match wins
+ENDPOINT_TTLS = [
+    ('nav', r'api\.bilibili\.com/x/web-interface/nav$', 0),   # login state / WBI keys: replay only
+    ('search', r'api\.bilibili\.com/x/web-interface/(wbi/)?search/', DAY / 4),
+    ('view', r'api\.bilibili\.com/x/web-interface/view$', 7 * DAY),
+    ('player', r'api\.bilibili\.com/x/player/(wbi/)?v2$', DAY),
+    ('subtitle', r'\.hdslb\.com/bfs/(ai_)?subtitle/', None),
+    ('dm_xml', r'api\.bilibili\.com/x/v1/dm/list\.so$', DAY),
+    ('dm_segment', r'api\.bilibili\.com/x/v2/dm/web/seg\.so$', DAY),
+    ('dm_history_index', r'api\.bilibili\.com/x/v2/dm/history/index$', DAY),
+    ('dm_history', r'api\.bilibili\.com/x/v2/dm/web/history/seg\.so$', None),  # past days: see response_ttl
+]
+DEFAULT_TTL = DAY
+
+# History snapshots are per day in Bilibili's calendar (UTC+8). A snapshot stored before
+# its day was over is still growing, so it only gets this TTL instead of never expiring.
+BILIBILI_TZ = timezone(timedelta(hours=8))
+OPEN_DAY_TTL = 3600
+
+# Query parameters that change on every request without changing the response
+VOLATILE_PARAMS = {'wts', 'w_rid', 'auth_key'}
+
+
+class CacheMiss(LookupError):
+    """Raised in replay mode for a request that was never recorded"""
+
+
+def endpoint_class(url):
+    """(endpoint class, TTL) of a URL"""
+    parts = urlsplit(url)
+    target = parts.netloc.lower() + parts.path
+    for name, pattern, ttl in ENDPOINT_TTLS:
+        if re.search(pattern, target):
+            return name, ttl
+    return 'other', DEFAULT_TTL
+
+
+def response_ttl(url, stored_at):
+    """TTL of a stored response: its endpoint's, except for history snapshots of a day that had not ended yet"""
+    name, ttl = endpoint_class(url)
+    if name == 'dm_history':
+        day = dict(parse_qsl(urlsplit(url).query)).get('date', '')
+        if day >= datetime.fromtimestamp(stored_at, BILIBILI_TZ).strftime('%Y-%m-%d'):
+            return OPEN_DAY_TTL
+    return ttl
+
+
+def normalize_url(url, params=None):
+    """Canonical form of a request: lower-case scheme/host, sorted params, volatile params dropped"""
+    if url.startswith('//'):
+        url = 'https:' + url
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    query += [(str(k), str(v)) for k, v in (params or {}).items()]
+    query = sorted((k, v) for k, v in query if k not in VOLATILE_PARAMS)
+    normalized = f"{parts.scheme.lower()}://{parts.netloc.lower()}{parts.path}"
+    return normalized + ("?" + urlencode(query) if query else "")
+
+
+def is_cacheable(status, body):
+    """200 responses only; JSON API responses must also report code 0"""
+    if status != 200:
+        return False
+    if body[:1] == b'{':
+        try:
+            return json.loads(body).get('code', 0) == 0
+        except ValueError:
+            return False
+    return True
+
+
+class CachedResponse:
+    """The part of requests.Response the crawlers use, served from the cache"""
+
+    from_cache = True
+
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+    def iter_content(self, chunk_size=65536):
+        for start in range(0, len(self.content), chunk_size):
+            yield self.content[start:start + chunk_size]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class HttpCache:
+    """On-disk request -> response cache with content-addressed, zstd-compressed bodies"""
+
+    def __init__(self, cache_dir=CACHE_DIR, mode=CACHE_MODE):
+        if mode not in MODES:
+            raise ValueError(f"HTTP_CACHE_MODE must be one of {MODES}, got {mode!r}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        if mode == 'off':
+            return
+        os.makedirs(os.path.join(cache_dir, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(cache_dir, "index.sqlite"), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, url TEXT NOT NULL, endpoint TEXT NOT NULL, status INTEGER NOT NULL, "
+            "content_hash TEXT NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @property
+    def readable(self):
+        return self.mode in ('readwrite', 'replay')
+
+    @property
+    def writable(self):
+        return self.mode in ('readwrite', 'record')
+
+    def _object_path(self, content_hash):
+        return os.path.join(self.cache_dir, "objects", content_hash[:2], content_hash + ".zst")
+
+    def _codecs(self):
+        """zstd compressor/decompressor are not thread-safe: one pair per thread"""
+        codecs = getattr(self._local, 'codecs', None)
+        if codecs is None:
+            codecs = (zstandard.ZstdCompressor(level=10), zstandard.ZstdDecompressor())
+            self._local.codecs = codecs
+        return codecs
+
+    def get(self, url, params=None):
+        """
+        Cached response for a request, or None if it has to be fetched.
+        In replay mode every recorded response is served and a miss raises CacheMiss.
+        """
+        if not self.readable:
+            self.misses += 1
+            return None
+        normalized = normalize_url(url, params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, content_hash, stored_at FROM responses WHERE key = ?",
+                (hashlib.sha256(normalized.encode()).hexdigest(),)
+            ).fetchone()
+        if row is not None:
+            status, content_hash, stored_at = row
+            ttl = response_ttl(normalized, stored_at)
+            fresh = ttl is None or time.time() - stored_at < ttl
+            if (fresh or self.mode == 'replay') and os.path.exists(self._object_path(content_hash)):
+                with open(self._object_path(content_hash), 'rb') as f:
+                    content = self._codecs()[1].decompress(f.read())
+                self.hits += 1
+                return CachedResponse(normalized, status, content)
+        self.misses += 1
+        if self.mode == 'replay':
+            raise CacheMiss(f"not recorded (HTTP_CACHE_MODE=replay): {normalized}")
+        return None
+
+    def put(self, url, params, status, content):
+        """Store a fetched response if it is cacheable"""
+        if not self.writable or not is_cacheable(status, content):
+            return
+        normalized = normalize_url(url, params)
+        content_hash = hashlib.sha256(content).hexdigest()
+        object_path = self._object_path(content_hash)
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            tmp_file = f"{object_path}.{threading.get_ident()}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(self._codecs()[0].compress(content))
+            os.replace(tmp_file, object_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, url, endpoint, status, content_hash, size, stored_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (hashlib.sha256(normalized.encode()).hexdigest(), normalized, endpoint_class(normalized)[0],
+                 status, content_hash, len(content), time.time())
+            )
+            self._conn.commit()
+
+    def discard(self, url, params=None):
+        """Forget a stored response (e.g. a body that turned out not to decode) so it is fetched again"""
+        if not self.writable:
+            return
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key = ?",
+                (hashlib.sha256(normalize_url(url, params).encode()).hexdigest(),)
+            )
+            self._conn.commit()
+
+    def stats(self):
+        """[(endpoint, responses, body bytes)] plus the compressed size of all objects"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT endpoint, COUNT(*), SUM(size) FROM responses GROUP BY endpoint ORDER BY endpoint"
+            ).fetchall()
+        stored = sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(os.path.join(self.cache_dir, "objects")) for name in names
+        )
+        return rows, stored
+
+    def purge_expired(self):
+        """Drop expired entries and the objects no entry refers to any more; returns (entries, objects)"""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute("SELECT key, url, stored_at FROM responses").fetchall()
+            ttls = [(key, response_ttl(url, stored_at), stored_at) for key, url, stored_at in rows]
+            expired = [(key,) for key, ttl, stored_at in ttls if ttl is not None and now - stored_at >= ttl]
+            self._conn.executemany("DELETE FROM responses WHERE key = ?", expired)
+            self._conn.commit()
+            referenced = {row[0] for row in self._conn.execute("SELECT content_hash FROM responses")}
+        removed = 0
+        for root, _, names in os.walk(os.path.join(self.cache_dir, "objects")):
+            for name in names:
+                if name.endswith(".zst") and name[:-len(".zst")] not in referenced:
+                    os.remove(os.path.join(root, name))
+                    removed += 1
+        return len(expired), removed
+
+
+_cache = None
+
+def get_cache():
+    """Process-wide shared cache instance (directory and mode from HTTP_CACHE_DIR / HTTP_CACHE_MODE)"""
+    global _cache
+    if _cache is None:
+        _cache = HttpCache()
+    return _cache
+
+
+def cached_get(controller, url, max_retries=5, params=None, **kwargs):
+    """controlled_get through the cache; a hit costs no request budget"""
+    cache = get_cache()
+    cached = cache.get(url, params)
+    if cached is not None:
+        return cached
+    response = controlled_get(controller, url, max_retries=max_retries, params=params, **kwargs)
+    cache.put(url, params, response.status_code, response.content)
+    return response
+
+
+class _RecordingResponse:
+    """Streaming requests.Response wrapper that keeps the chunks it hands out"""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.chunks = []
+        self.complete = False
+
+    def iter_content(self, chunk_size=65536):
+        for chunk in self._response.iter_content(chunk_size=chunk_size):
+            self.chunks.append(chunk)
+            yield chunk
+        self.complete = True
+
+
+@contextmanager
+def cached_stream(controller, url, params=None, **kwargs):
+    """
+    Streaming GET through the cache (for incremental parsers). On a hit the cached body is
+    yielded in chunks; otherwise the live response is paced by `controller` and, when the
+    body was read to the end, stored afterwards.
+    """
+    cache = get_cache()
+    cached = cache.get(url, params)
+    if cached is not None:
+        yield cached
+        return
+    controller.acquire()
+    with requests.get(url, params=params, stream=True, **kwargs) as response:
+        controller.record(response.status_code)
+        if response.status_code != 200 or not cache.writable:
+            yield response
+            return
+        recording = _RecordingResponse(response)
+        yield recording
+    if recording.complete:
+        cache.put(url, params, recording.status_code, b''.join(recording.chunks))
+
+
+async def cached_fetch_async(session, controller, url, params=None, headers=None, timeout=20, max_retries=1):
+    """
+    aiohttp GET through the cache; returns (status, body).
+    Live requests are paced by `controller` (None = unpaced, e.g. CDN files) and
+    throttled responses are retried up to max_retries times.
+    """
+    import aiohttp
+
+    cache = get_cache()
+    cached = cache.get(url, params)
+    if cached is not None:
+        return cached.status_code, cached.content
+    for attempt in range(max_retries):
+        if controller is not None:
+            await controller.acquire_async()
+        async with session.get(url, params=params, headers=headers,
+                               timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            body = await response.read()
+        throttled = controller is not None and controller.record(response.status)
+        if not throttled or attempt == max_retries - 1:
+            break
+        print(f"  [WARN] HTTP {response.status}, retrying at {controller.rate:.2f} req/s "
+              f"({attempt + 2}/{max_retries})")
+    cache.put(url, params, response.status, body)
+    return response.status, body
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('--stats', '--purge-expired'):
+        print("Usage: python http_cache.py --stats | --purge-expired")
+        return
+    cache = HttpCache(mode='readwrite')
+    if sys.argv[1] == '--purge-expired':
+        entries, objects = cache.purge_expired()
+        print(f"[PURGED] {entries} expired entries, {objects} unreferenced objects")
+    rows, stored = cache.stats()
+    total = sum(size or 0 for _, _, size in rows)
+    for endpoint, count, size in rows:
+        print(f"  {endpoint:<18} {count:>8,} responses {(size or 0) / 1e6:>10.1f} MB")
+    print(f"[CACHE] {cache.cache_dir}: {sum(count for _, count, _ in rows):,} responses, "
+          f"{total / 1e6:.1f} MB of bodies stored in {stored / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""
+问号弹幕分析结果的规范化存储格式（JSON Lines，逐视频增量写入）
+
+output_dir/
+├── question_events.jsonl        # 每行一个事件（问号弹幕或问号风暴），附 danmaku_rows = [起始行, 结束行)
+└── danmaku/{bvid}.jsonl         # 每个视频共享的弹幕表（按时间排序），事件通过行号区间引用
+
+同一条弹幕在表中只写一次，不再在每个事件里重复序列化；写入与读取都按视频流式进行
+"""
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, List, Tuple
+
+EVENTS_FILE = "question_events.jsonl"
+DANMAKU_SUBDIR = "danmaku"
+
+
+def _json_default(value):
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.bool_):
+        return bool(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """
+    合并重叠或相邻的 [lo, hi) 区间
+    """
+    merged = []
+    for lo, hi in sorted(ranges):
+        if merged and lo <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+class QuestionEventWriter:
+    """
+    增量写出事件表与各视频的共享弹幕表
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_dir = output_dir
+        self.danmaku_dir = os.path.join(output_dir, DANMAKU_SUBDIR)
+        os.makedirs(self.danmaku_dir, exist_ok=True)
+        self._events = open(os.path.join(output_dir, EVENTS_FILE), 'w', encoding='utf-8')
+        self.event_count = 0
+
+    def write_video(self, bvid: str, sorted_df: pd.DataFrame, events: List[Dict]):
+        """
+        写出一个视频的事件
+
+        sorted_df 为按 (分P, danmaku_time) 排序的弹幕表；每个事件的 danmaku_rows 是该表中的 [lo, hi) 行区间。
+        只保留被至少一个事件引用的行，并将区间重新映射到精简后的表上
+        """
+        if not events:
+            return
+
+        covered = _merge_ranges([tuple(event['danmaku_rows']) for event in events])
+        offsets = []
+        position = 0
+        for lo, hi in covered:
+            offsets.append((lo, hi, position))
+            position += hi - lo
+
+        rows = np.concatenate([np.arange(lo, hi) for lo, hi in covered]) if covered else np.array([], dtype=np.int64)
+        table = sorted_df.iloc[rows]
+        table_path = os.path.join(self.danmaku_dir, f"{bvid}.jsonl")
+        table.to_json(table_path, orient='records', lines=True, force_ascii=False, double_precision=15)
+
+        for event in events:
+            lo, hi = event['danmaku_rows']
+            for block_lo, block_hi, block_start in offsets:
+                if block_lo <= lo and hi <= block_hi:
+                    lo, hi = block_start + lo - block_lo, block_start + hi - block_lo
+                    break
+            # 缺失值（NaN、np.float32 的 NaN、pd.NA 等）写为 null；allow_nan=False 保证不会写出非法的 NaN
+            record = {key: (None if pd.api.types.is_scalar(value) and pd.isna(value) else value)
+                      for key, value in event.items()}
+            record['danmaku_rows'] = [int(lo), int(hi)]
+            self._events.write(json.dumps(record, ensure_ascii=False, default=_json_default, allow_nan=False))
+            self._events.write('\n')
+            self.event_count += 1
+        self._events.flush()
+
+    def close(self):
+        self._events.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class QuestionEvents:
+    """
+    已写出的事件集合：len() 为事件数，每次迭代都从磁盘流式读取（见 iter_question_events），不在内存中保留全部事件
+    """
+
+    def __init__(self, output_dir: str, count: int):
+        self.output_dir = output_dir
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator[Dict]:
+        if self.count == 0:
+            return iter([])
+        return iter_question_events(self.output_dir)
+
+
+def iter_question_events(output_dir: str, with_danmaku: bool = True) -> Iterator[Dict]:
+    """
+    流式读取事件表；with_danmaku=True 时按区间还原 nearby_danmaku（同一时间只加载一个视频的弹幕表）
+    """
+    events_path = os.path.join(output_dir, EVENTS_FILE)
+    current_bvid = None
+    current_rows: List[Dict] = []
+
+    with open(events_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            event = json.loads(line)
+            if with_danmaku:
+                if event['bvid'] != current_bvid:
+                    current_bvid = event['bvid']
+                    current_rows = load_video_danmaku(output_dir, current_bvid)
+                lo, hi = event['danmaku_rows']
+                center_time = event.get('window_center', event['question_time'])
+                nearby = []
+                for row in current_rows[lo:hi]:
+                    row = dict(row)
+                    row['time_diff'] = row['danmaku_time'] - center_time
+                    nearby.append(row)
+                event['nearby_danmaku'] = nearby
+            yield event
+
+
+def load_video_danmaku(output_dir: str, bvid: str) -> List[Dict]:
+    """
+    读取单个视频的共享弹幕表
+    """
+    table_path = os.path.join(output_dir, DANMAKU_SUBDIR, f"{bvid}.jsonl")
+    rows = []
+    with open(table_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                rows.append(json.loads(line))
+    return rows
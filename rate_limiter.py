@@ -0,0 +1,154 @@
+"""
+Request rate limiting shared by the crawler scripts (01, 02, 04)
+A token bucket enforces a global request budget for both blocking
+(requests) and asyncio (aiohttp) callers; AdaptiveRateController adjusts
+that budget from HTTP feedback (AIMD).
+"""
+
+import asyncio
+import json
+import threading
+import time
+import requests
+
+
+class TokenBucket:
+    """Token bucket: `rate` requests per second on average, bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take one token (possibly on credit) and return how long the caller must wait"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def acquire(self):
+        """Block until a request may be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """Wait (without blocking the event loop) until a request may be sent"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+# HTTP statuses that mean "slow down": 412 is Bilibili's anti-crawler response
+THROTTLE_STATUSES = {412, 429, 500, 502, 503, 504}
+
+
+class AdaptiveRateController:
+    """
+    AIMD request-rate controller on top of a TokenBucket
+
+    Every response is reported through record(): throttling statuses cut the
+    rate multiplicatively (at most once per `cooldown` seconds, so one burst of
+    412s from in-flight requests counts once), successes raise it additively.
+    The rate therefore settles just under the platform's limit instead of
+    alternating between full speed and long stalls. The current rate is
+    published to listeners and, optionally, to a JSON status file.
+    """
+
+    def __init__(self, initial_rate: float, min_rate: float = 0.05, max_rate: float = 5.0,
+                 burst: float = 1.0, increase: float = 0.05, decrease: float = 0.5,
+                 cooldown: float = 5.0, status_file: str = None, name: str = "crawler"):
+        self.bucket = TokenBucket(initial_rate, burst)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.status_file = status_file
+        self.name = name
+        self.listeners = []
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def add_listener(self, callback):
+        """callback(rate) is called whenever the rate changes"""
+        self.listeners.append(callback)
+
+    def acquire(self):
+        self.bucket.acquire()
+
+    async def acquire_async(self):
+        await self.bucket.acquire_async()
+
+    def record(self, status_code: int) -> bool:
+        """Report a response status; returns True if it was a throttling response"""
+        if status_code in THROTTLE_STATUSES:
+            self.on_throttle()
+            return True
+        if 200 <= status_code < 300:
+            self.on_success()
+        return False
+
+    def on_success(self):
+        with self._lock:
+            new_rate = min(self.max_rate, self.bucket.rate + self.increase)
+        self._set_rate(new_rate)
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.cooldown:
+                return
+            self._last_decrease = now
+            new_rate = max(self.min_rate, self.bucket.rate * self.decrease)
+        print(f"  [RATE] {self.name}: throttled, rate -> {new_rate:.2f} req/s")
+        self._set_rate(new_rate)
+
+    def _set_rate(self, new_rate: float):
+        with self.bucket._lock:
+            if new_rate == self.bucket.rate:
+                return
+            # Settle tokens earned at the old rate before switching
+            now = time.monotonic()
+            self.bucket.tokens = min(self.bucket.capacity,
+                                     self.bucket.tokens + (now - self.bucket.updated) * self.bucket.rate)
+            self.bucket.updated = now
+            self.bucket.rate = new_rate
+        self._publish(new_rate)
+
+    def _publish(self, rate: float):
+        for callback in self.listeners:
+            callback(rate)
+        if self.status_file:
+            try:
+                with open(self.status_file, 'w', encoding='utf-8') as f:
+                    json.dump({'name': self.name, 'rate': rate, 'updated': time.time()}, f)
+            except OSError:
+                pass
+
+
+def controlled_get(controller: AdaptiveRateController, url: str, max_retries: int = 5, **kwargs):
+    """
+    requests.get paced by the controller; throttled responses are retried
+    (the controller has already slowed down) up to max_retries times.
+    Returns the last response.
+    """
+    for attempt in range(max_retries):
+        controller.acquire()
+        response = requests.get(url, **kwargs)
+        if not controller.record(response.status_code) or attempt == max_retries - 1:
+            return response
+        print(f"  [WARN] HTTP {response.status_code}, retrying at {controller.rate:.2f} req/s "
+              f"({attempt + 2}/{max_retries})")
+    return response
@@ -0,0 +1,173 @@
+"""
+语音活动检测（VAD）切块与时间戳拼接（05 使用）
+整段 transcribe 一个长视频是按 30 秒窗口顺序推进的，并且会在音乐、静音上浪费时间。
+这里先做一遍 VAD，只保留语音区间，过长的语音在其中最安静处切成不超过 max_chunk_s 秒的块，
+只有间隙很短（< MAX_MERGE_GAP_S）的相邻区间才合并，较长的静音、音乐不会再送进模型：
+各块可以单独（或经 transcription_pool 并行）转录，最后按块起始采样点把时间戳平移回整段音频，
+输出的 from / to 仍是相对整个视频的秒数，07 的对齐不受影响。
+
+VAD：已安装 faster-whisper 时用其自带的 Silero VAD（ONNX，CPU 上很快，能区分音乐与人声）；
+否则退回能量阈值（只能去掉静音）。
+"""
+
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from asr_backends import SAMPLE_RATE
+
+Region = Tuple[int, int]      # [start, end) 采样点
+
+MAX_MERGE_GAP_S = 1.0         # 相邻语音区间的间隙短于此值才合并到同一块
+
+
+def load_pcm(audio) -> np.ndarray:
+    """
+    任意音频 -> 16 kHz 单声道 float32 数组：数组原样返回，.f32 内存映射，其余文件经 ffmpeg 解码
+    """
+    if not isinstance(audio, str):
+        return audio
+    if audio.endswith(".f32"):
+        return np.memmap(audio, dtype=np.float32, mode="c")
+    out = subprocess.run(
+        ["ffmpeg", "-nostdin", "-v", "error", "-i", audio,
+         "-f", "f32le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        capture_output=True, check=True
+    ).stdout
+    return np.frombuffer(out, dtype=np.float32)
+
+
+def energy_speech(audio: np.ndarray, min_silence_ms: int = 500, speech_pad_ms: int = 200,
+                  max_speech_s: Optional[float] = None, frame_ms: int = 30, margin_db: float = 15.0,
+                  min_speech_ms: int = 250) -> List[Region]:
+    """
+    能量阈值 VAD：帧能量高于（底噪 + margin_db）视为语音；短于 min_silence_ms 的间隙合并；
+    长于 max_speech_s 的区间在其后半段能量最低的帧处拆开
+    """
+    frame = SAMPLE_RATE * frame_ms // 1000
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return []
+    frames = np.asarray(audio[:n_frames * frame], dtype=np.float32).reshape(n_frames, frame)
+    db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    threshold = max(np.percentile(db, 10) + margin_db, -50.0)
+    voiced = db > threshold
+
+    regions = []
+    start = None
+    for i, v in enumerate(voiced):
+        if v and start is None:
+            start = i
+        elif not v and start is not None:
+            regions.append([start * frame, i * frame])
+            start = None
+    if start is not None:
+        regions.append([start * frame, n_frames * frame])
+
+    regions = _tidy(regions, len(audio), min_silence_ms, speech_pad_ms, min_speech_ms)
+    if max_speech_s is None:
+        return regions
+    return _split_quietest(regions, db, frame, int(max_speech_s * SAMPLE_RATE))
+
+
+def _split_quietest(regions: List[Region], db: np.ndarray, frame: int, limit: int) -> List[Region]:
+    """
+    把长于 limit 的区间拆开：切点取 [起点 + limit/2, 起点 + limit] 内能量最低的帧
+    """
+    result = []
+    for start, end in regions:
+        while end - start > limit:
+            lo = (start + limit // 2) // frame
+            hi = min((start + limit) // frame, len(db))
+            cut = (lo + int(np.argmin(db[lo:hi]))) * frame if hi > lo else start + limit
+            cut = min(max(cut, start + frame), start + limit)
+            result.append((start, cut))
+            start = cut
+        result.append((start, end))
+    return result
+
+
+def silero_speech(audio: np.ndarray, min_silence_ms: int = 500, speech_pad_ms: int = 200,
+                  max_speech_s: Optional[float] = None) -> List[Region]:
+    """
+    Silero VAD；max_speech_s 交给 VadOptions.max_speech_duration_s，由 Silero 在最合适的静音处拆分长语音
+    （扣除两侧边距，使加边距后的区间仍不超过 max_speech_s）
+    """
+    from faster_whisper.vad import VadOptions, get_speech_timestamps
+    max_duration = float("inf") if max_speech_s is None else max_speech_s - 2 * speech_pad_ms / 1000
+    options = VadOptions(min_silence_duration_ms=min_silence_ms, speech_pad_ms=speech_pad_ms,
+                         max_speech_duration_s=max_duration)
+    return [(ts["start"], ts["end"]) for ts in get_speech_timestamps(np.asarray(audio, dtype=np.float32), options)]
+
+
+def _tidy(regions, total: int, min_silence_ms: int, speech_pad_ms: int, min_speech_ms: int) -> List[Region]:
+    """
+    加边距、合并过近的区间、去掉过短的区间
+    """
+    pad = SAMPLE_RATE * speech_pad_ms // 1000
+    gap = SAMPLE_RATE * min_silence_ms // 1000
+    shortest = SAMPLE_RATE * min_speech_ms // 1000
+    merged = []
+    for start, end in regions:
+        if end - start < shortest:
+            continue
+        start, end = max(0, start - pad), min(total, end + pad)
+        if merged and start - merged[-1][1] < gap:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(start, end) for start, end in merged]
+
+
+def detect_speech(audio: np.ndarray, min_silence_ms: int = 500, speech_pad_ms: int = 200,
+                  max_speech_s: Optional[float] = None) -> List[Region]:
+    try:
+        return silero_speech(audio, min_silence_ms, speech_pad_ms, max_speech_s)
+    except ImportError:
+        return energy_speech(audio, min_silence_ms, speech_pad_ms, max_speech_s)
+
+
+def plan_chunks(regions: List[Region], max_chunk_s: float, max_gap_s: float = MAX_MERGE_GAP_S) -> List[Region]:
+    """
+    间隙短于 max_gap_s 的相邻语音区间合并成块，块长（首个区间起点到末个区间终点）不超过 max_chunk_s；
+    长语音已由 VAD 在静音处拆开，仍超长的区间（如 VAD 两侧边距）才按 max_chunk_s 硬切
+    """
+    limit = int(max_chunk_s * SAMPLE_RATE)
+    gap = int(max_gap_s * SAMPLE_RATE)
+    chunks = []
+    for start, end in regions:
+        while end - start > limit:
+            chunks.append((start, start + limit))
+            start += limit
+        if chunks and start - chunks[-1][1] < gap and end - chunks[-1][0] <= limit:
+            chunks[-1] = (chunks[-1][0], end)
+        else:
+            chunks.append((start, end))
+    return chunks
+
+
+def split_speech(audio: np.ndarray, max_chunk_s: float = 60, min_silence_ms: int = 500,
+                 speech_pad_ms: int = 200) -> List[Region]:
+    """
+    VAD + 切块，返回各块的 [start, end) 采样点（不含语音的部分不在任何块中）
+    """
+    return plan_chunks(detect_speech(audio, min_silence_ms, speech_pad_ms, max_chunk_s), max_chunk_s)
+
+
+def stitch(chunk_results: List[Tuple[int, int, List[Dict]]]) -> List[Dict]:
+    """
+    [(块起点, 块终点, 块内字幕)] -> 整段音频上的字幕：时间加上块起点偏移（按采样点精确计算），
+    并截断到块的范围内（模型偶尔给出超出块尾的结束时间）
+    """
+    subtitles = []
+    for start, end, chunk_subtitles in sorted(chunk_results, key=lambda item: item[0]):
+        offset = start / SAMPLE_RATE
+        chunk_end = end / SAMPLE_RATE
+        for sub in chunk_subtitles:
+            begin = min(offset + sub["from"], chunk_end)
+            subtitles.append(dict(
+                sub,
+                **{"from": round(begin, 3), "to": round(max(begin, min(offset + sub["to"], chunk_end)), 3)}
+            ))
+    return subtitles
@@ -0,0 +1,96 @@
+"""
+字幕缓存与区间索引
+每个视频的 {bvid}_subtitle.json 在一次运行中只读取一次，按 from 排序存入数组，
+供 07（逐条弹幕匹配）和 08（问号弹幕上下文窗口）共用
+"""
+
+import json
+import os
+import numpy as np
+from typing import List, Dict, Optional
+
+
+class VideoSubtitles:
+    """
+    单个视频的字幕及其区间索引
+    """
+
+    def __init__(self, subtitles: List[Dict]):
+        self.subtitles = subtitles
+        froms = np.array([sub['from'] for sub in subtitles], dtype=float)
+        tos = np.array([sub['to'] for sub in subtitles], dtype=float)
+        self.order = np.argsort(froms, kind='stable')
+        self.sorted_from = froms[self.order]
+        self.sorted_to = tos[self.order]
+        # 最长字幕时长：from < start - max_duration 的字幕不可能与窗口相交
+        self.max_duration = float(np.max(tos - froms)) if len(subtitles) else 0.0
+
+    def __len__(self):
+        return len(self.subtitles)
+
+    def overlapping(self, start_time: float, end_time: float) -> np.ndarray:
+        """
+        返回与 [start_time, end_time] 相交的字幕下标（按文件中的原始顺序）
+        """
+        if not self.subtitles:
+            return np.array([], dtype=np.int64)
+        lo = np.searchsorted(self.sorted_from, start_time - self.max_duration, side='left')
+        hi = np.searchsorted(self.sorted_from, end_time, side='right')
+        mask = self.sorted_to[lo:hi] >= start_time
+        return np.sort(self.order[lo:hi][mask])
+
+
+class SubtitleStore:
+    """
+    按 bvid 缓存字幕文件，同一视频只解析一次 JSON
+    """
+
+    def __init__(self, subtitle_dir: str = "Data"):
+        self.subtitle_dir = subtitle_dir
+        self._cache: Dict[str, Optional[VideoSubtitles]] = {}
+
+    def path(self, bvid: str) -> str:
+        return os.path.join(self.subtitle_dir, f"{bvid}_subtitle.json")
+
+    def get(self, bvid: str) -> Optional[VideoSubtitles]:
+        """
+        获取视频字幕；字幕文件不存在时返回 None（结果同样会被缓存）
+        """
+        if bvid not in self._cache:
+            json_path = self.path(bvid)
+            if os.path.exists(json_path):
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    self._cache[bvid] = VideoSubtitles(json.load(f))
+            else:
+                self._cache[bvid] = None
+        return self._cache[bvid]
+
+    def window(self, bvid: str, center_time: float, window_seconds: float) -> List[Dict]:
+        """
+        获取指定时间前后 window_seconds 秒内的所有字幕，附带相对中心时间的 time_diff
+        """
+        video_subtitles = self.get(bvid)
+        if video_subtitles is None:
+            return []
+
+        result = []
+        for i in video_subtitles.overlapping(center_time - window_seconds, center_time + window_seconds):
+            sub = video_subtitles.subtitles[i]
+            result.append({
+                'from': sub['from'],
+                'to': sub['to'],
+                'content': sub['content'],
+                'time_diff': sub['from'] - center_time
+            })
+        return result
+
+
+_stores: Dict[str, SubtitleStore] = {}
+
+def get_store(subtitle_dir: str = "Data") -> SubtitleStore:
+    """
+    返回本次运行中该目录对应的共享 SubtitleStore
+    """
+    if subtitle_dir not in _stores:
+        _stores[subtitle_dir] = SubtitleStore(subtitle_dir)
+    return _stores[subtitle_dir]
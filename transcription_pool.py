@@ -0,0 +1,204 @@
+"""
+多进程转录池（05、06 共用）
+单个模型进程的计算线程数超过一定值后加速基本停滞，多核机器上大部分核心空闲；
+这里启动 N 个模型进程，每个进程固定 threads 个计算线程（可选绑定到互不重叠的 CPU 核），
+并按音频时长“最长优先”调度，避免最后只剩一个长视频在单进程上慢慢跑。
+
+    with TranscriptionPool("faster-whisper", "medium", workers=8, threads=4) as pool:
+        for key, audio, subtitles, error in pool.run(jobs):   # jobs：(key, audio) 的可迭代对象
+            ...
+
+audio 与 asr_backends 相同：文件路径、.f32 原始 PCM 或 16 kHz float32 数组
+（数组需整体传给子进程；长视频建议用路径 / .f32，只传文件名）
+"""
+
+import os
+import heapq
+import threading
+import multiprocessing as mp
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import asr_backends
+
+# 子进程内的后端（每个进程加载一次模型）
+_backend: Optional[asr_backends.ASRBackend] = None
+
+
+def _init_worker(backend_name: str, model_size: str, threads: int, cores, options: Dict):
+    """
+    子进程初始化：限制计算线程数、绑定 CPU 核、加载模型
+    """
+    global _backend
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[var] = str(threads)
+    if cores is not None and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cores.get())
+        except Exception:
+            pass
+    if backend_name == "whisper":
+        import torch
+        torch.set_num_threads(threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass
+    else:
+        options = dict(options, cpu_threads=threads)
+    _backend = asr_backends.load_backend(backend_name, model_size, **options)
+
+
+def _transcribe(audio) -> List[Dict]:
+    return _backend.transcribe(audio)
+
+
+def core_groups(workers: int, threads: int) -> Optional[List[List[int]]]:
+    """
+    把可用 CPU 核切成 workers 组、每组 threads 个；核数不够或平台不支持时返回 None（不绑定）
+    """
+    if not hasattr(os, "sched_getaffinity"):
+        return None
+    cores = sorted(os.sched_getaffinity(0))
+    if len(cores) < workers * threads:
+        return None
+    return [cores[i * threads:(i + 1) * threads] for i in range(workers)]
+
+
+class TranscriptionPool:
+    """
+    N 个模型进程 + 最长优先调度；用作上下文管理器，退出时关闭进程池。
+    有子进程异常退出（如内存不足被杀）时自动重建进程池
+    """
+
+    def __init__(self, backend_name: str, model_size: str, workers: int, threads: int,
+                 pin_cores: bool = True, **backend_options):
+        self.backend_name = asr_backends.resolve_backend(backend_name)
+        self.model_size = model_size
+        self.workers = workers
+        self.threads = threads
+        self.backend_options = backend_options
+
+        # spawn：调用方（05 的下载线程）已在运行，fork 带线程的进程不安全
+        self.context = mp.get_context("spawn")
+        self.core_groups = core_groups(workers, threads) if pin_cores else None
+        self.pinned = self.core_groups is not None
+        self.restarts = 0
+        self._start_executor()
+
+    def _start_executor(self):
+        """
+        启动进程池；绑核时每次用新的队列分发各组 CPU 核（旧队列可能已被取空）
+        """
+        cores = None
+        if self.core_groups:
+            cores = self.context.Queue()
+            for group in self.core_groups:
+                cores.put(group)
+        self.executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=self.context, initializer=_init_worker,
+            initargs=(self.backend_name, self.model_size, self.threads, cores, self.backend_options)
+        )
+
+    def _restart(self):
+        """
+        进程池损坏（有子进程异常退出）后丢弃旧池、重建新池；新池的子进程会重新加载模型
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.restarts += 1
+        self._start_executor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def run(self, jobs: Iterable[Tuple[str, object]], window: Optional[int] = None,
+            retries: int = 1) -> Iterator[Tuple[str, object, Optional[List[Dict]], Optional[Exception]]]:
+        """
+        转录 jobs 中的所有 (key, audio)，按完成顺序产出 (key, audio, subtitles, error)
+        - 后台线程从 jobs 读取任务，待调度任务最多 window 个（默认 2×workers），
+          因此 jobs 可以是边下载边产出的生成器
+        - 每当有进程空闲，取待调度任务中时长最长的一个
+        - 失败的任务重新排队，最多尝试 retries 次；仍失败则 subtitles 为 None、error 为最后的异常
+        - 有子进程异常退出时进程池整体不可用（BrokenProcessPool）：重建进程池，
+          在途任务全部记一次失败并按上一条重新排队
+        """
+        window = window or 2 * self.workers
+        cond = threading.Condition()
+        pending = []                   # 堆：(-时长, 序号, key, audio, 已尝试次数)
+        feed_state = {"done": False, "error": None}
+
+        def feed():
+            try:
+                for seq, (key, audio) in enumerate(jobs):
+                    duration = asr_backends.audio_duration(audio)
+                    with cond:
+                        while len(pending) >= window:
+                            cond.wait()
+                        heapq.heappush(pending, (-duration, seq, key, audio, 0))
+                        cond.notify_all()
+            except Exception as e:
+                feed_state["error"] = e
+            finally:
+                with cond:
+                    feed_state["done"] = True
+                    cond.notify_all()
+
+        threading.Thread(target=feed, daemon=True).start()
+
+        in_flight = {}
+        while True:
+            with cond:
+                while pending and len(in_flight) < self.workers:
+                    neg_duration, seq, key, audio, attempts = heapq.heappop(pending)
+                    try:
+                        future = self.executor.submit(_transcribe, audio)
+                    except BrokenProcessPool:
+                        # 任务未开始，放回队列；有在途任务时由下面的结果处理负责重建
+                        heapq.heappush(pending, (neg_duration, seq, key, audio, attempts))
+                        if in_flight:
+                            break
+                        self._restart()
+                        continue
+                    in_flight[future] = (neg_duration, seq, key, audio, attempts + 1)
+                    cond.notify_all()
+                if not in_flight:
+                    if feed_state["done"] and not pending:
+                        break
+                    cond.wait()
+                    continue
+
+            # 短超时：等待期间若有新任务到达且有空闲进程，尽快派发
+            finished, _ = wait(in_flight, timeout=0.2, return_when=FIRST_COMPLETED)
+            failed = []
+            for future in finished:
+                job = in_flight.pop(future)
+                try:
+                    subtitles = future.result()
+                except Exception as e:
+                    failed.append((job, e))
+                    continue
+                yield job[2], job[3], subtitles, None
+
+            broken = next((e for _, e in failed if isinstance(e, BrokenProcessPool)), None)
+            if broken is not None:
+                # 其余在途任务的结果也已不可用，同样记一次失败
+                failed += [(job, broken) for job in in_flight.values()]
+                in_flight.clear()
+                self._restart()
+
+            for (neg_duration, seq, key, audio, attempts), e in failed:
+                if attempts < retries:
+                    with cond:
+                        heapq.heappush(pending, (neg_duration, seq, key, audio, attempts))
+                    continue
+                yield key, audio, None, e
+
+        if feed_state["error"] is not None:
+            raise feed_state["error"]
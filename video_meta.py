@@ -0,0 +1,196 @@
+"""
+Video metadata via the lightweight JSON view API
+Resolves every page (P) of a video: cid, page number, part title, duration
+and the page's start offset on the concatenated multi-P timeline.
+
+Responses are kept in a persistent SQLite cache keyed by bvid, shared by
+all stages (01-04), so each video is resolved once across stages and reruns.
+Warm the cache for a whole index with:
+
+    python video_meta.py --prefetch video_index.csv
+"""
+
+import asyncio
+import json
+import sqlite3
+import sys
+import threading
+import time
+from rate_limiter import AdaptiveRateController
+from http_cache import cached_fetch_async, cached_get
+
+VIEW_API = "https://api.bilibili.com/x/web-interface/view"
+CACHE_FILE = "video_meta_cache.sqlite"
+# Throttled view calls (412/429/5xx) are retried this many times, sync and async alike
+VIEW_MAX_RETRIES = 5
+
+# Prefetch settings
+PREFETCH_REQUESTS_PER_SECOND = 2.0
+PREFETCH_CONCURRENCY = 8
+
+
+def pages_from_view(view_json):
+    """
+    Extract the page list from a view API response
+
+    Returns [{'cid', 'page', 'part', 'duration', 'offset_sec'}, ...] ordered by page,
+    or [] if the response carries no video data.
+    """
+    data = view_json.get('data') or {}
+    pages = data.get('pages') or []
+    if not pages and data.get('cid'):
+        pages = [{'cid': data['cid'], 'page': 1, 'part': data.get('title', ''),
+                  'duration': data.get('duration', 0)}]
+
+    result = []
+    offset = 0
+    for page in sorted(pages, key=lambda p: p.get('page', 0)):
+        duration = page.get('duration') or 0
+        result.append({
+            'cid': str(page['cid']),
+            'page': page.get('page', len(result) + 1),
+            'part': page.get('part', ''),
+            'duration': duration,
+            'offset_sec': offset
+        })
+        offset += duration
+    return result
+
+
+class VideoMetaCache:
+    """On-disk bvid -> view API `data` cache (SQLite)"""
+
+    def __init__(self, path=CACHE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS video_meta ("
+            "bvid TEXT PRIMARY KEY, cid TEXT, title TEXT, duration INTEGER, "
+            "data TEXT NOT NULL, fetched_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, bvid):
+        """Cached view `data` dict, or None"""
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM video_meta WHERE bvid = ?", (bvid,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_pages(self, bvid):
+        """Cached page list (see pages_from_view), or None"""
+        data = self.get(bvid)
+        return pages_from_view({'data': data}) if data else None
+
+    def put(self, bvid, data):
+        """Store the `data` object of a successful view API response"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO video_meta (bvid, cid, title, duration, data, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (bvid, str(data.get('cid', '')), data.get('title', ''), data.get('duration', 0),
+                 json.dumps(data, ensure_ascii=False), time.time())
+            )
+            self._conn.commit()
+
+    def missing(self, bvids):
+        """The subset of bvids not cached yet"""
+        with self._lock:
+            cached = {row[0] for row in self._conn.execute("SELECT bvid FROM video_meta")}
+        return [bvid for bvid in bvids if bvid not in cached]
+
+
+_cache = None
+
+def get_cache():
+    """Process-wide shared cache instance"""
+    global _cache
+    if _cache is None:
+        _cache = VideoMetaCache()
+    return _cache
+
+
+def cached_pubdate(bvid):
+    """Publish time (unix seconds) of a cached video, or None"""
+    data = get_cache().get(bvid)
+    return data.get('pubdate') if data else None
+
+
+def fetch_video_pages(bvid, controller, headers, timeout=20):
+    """Resolve all pages of a video, from the cache or the view API (paced by `controller`)"""
+    cache = get_cache()
+    pages = cache.get_pages(bvid)
+    if pages:
+        return pages
+
+    response = cached_get(controller, VIEW_API, max_retries=VIEW_MAX_RETRIES, params={'bvid': bvid},
+                          headers=headers, timeout=timeout)
+    view_json = response.json()
+    if view_json.get('code') != 0:
+        raise RuntimeError(f"view API error: {view_json.get('message')}")
+    cache.put(bvid, view_json['data'])
+    return pages_from_view(view_json)
+
+
+async def fetch_video_pages_async(session, bvid, controller, headers):
+    """Async version of fetch_video_pages for aiohttp-based crawlers"""
+    cache = get_cache()
+    pages = cache.get_pages(bvid)
+    if pages:
+        return pages
+
+    status, body = await cached_fetch_async(session, controller, VIEW_API, params={'bvid': bvid}, headers=headers,
+                                            max_retries=VIEW_MAX_RETRIES)
+    if status != 200:
+        raise RuntimeError(f"view API error: HTTP {status}")
+    view_json = json.loads(body)
+    if view_json.get('code') != 0:
+        raise RuntimeError(f"view API error: {view_json.get('message')}")
+    cache.put(bvid, view_json['data'])
+    return pages_from_view(view_json)
+
+
+async def prefetch(bvids, headers):
+    """Warm the cache for many videos concurrently under an adaptive rate limit"""
+    import aiohttp
+
+    controller = AdaptiveRateController(PREFETCH_REQUESTS_PER_SECOND, name="video_meta")
+    semaphore = asyncio.Semaphore(PREFETCH_CONCURRENCY)
+    counts = {'ok': 0, 'failed': 0}
+
+    async with aiohttp.ClientSession() as session:
+        async def worker(bvid):
+            async with semaphore:
+                try:
+                    await fetch_video_pages_async(session, bvid, controller, headers)
+                    counts['ok'] += 1
+                except Exception as e:
+                    counts['failed'] += 1
+                    print(f"  [ERROR] {bvid}: {e}")
+
+        await asyncio.gather(*[worker(bvid) for bvid in bvids])
+    return counts
+
+
+def main():
+    import pandas as pd
+
+    if len(sys.argv) < 3 or sys.argv[1] != '--prefetch':
+        print("Usage: python video_meta.py --prefetch video_index.csv")
+        return
+
+    index_file = sys.argv[2]
+    bvids = pd.read_csv(index_file, encoding='utf-8-sig')['bvid'].dropna().astype(str).tolist()
+    pending = get_cache().missing(bvids)
+    print(f"[INFO] {len(bvids)} videos in index, {len(pending)} not cached")
+
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+        "Referer": "https://www.bilibili.com/",
+    }
+    counts = asyncio.run(prefetch(pending, headers))
+    print(f"[DONE] Cached: {counts['ok']}, failed: {counts['failed']} -> {CACHE_FILE}")
+
+
+if __name__ == "__main__":
+    main()